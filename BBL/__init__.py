@@ -0,0 +1,16 @@
+"""
+BBL: Code sets up the BBL environment for a simulation involving
+the locations of Chicago food trucks
+
+BBL.kernel holds the states, policies and simulations and only needs numpy
+and pandas. BBL.estimation adds the sympy parameters and profits and the
+estimation of the parameters (sympy and scipy). Nothing is imported here so
+that simulation jobs only pay for the kernel
+"""
+
+__author__ = 'Eliot Abrams'
+__copyright__ = "Copyright (C) 2015 Eliot Abrams"
+__license__ = "MIT"
+__version__ = "1.0.0"
+__email__ = "eabrams@uchicago.edu"
+__status__ = "Production"
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+
+"""
+counts.py: Keeps the counts behind the probabilities of find_probabilities
+(of each truck's actions in each sub-state and of the sub-states) on disk
+so that new weeks of parking data can be added to them and the policy table
+refreshed without recomputing the full history
+"""
+
+__author__ = 'Eliot Abrams'
+__copyright__ = "Copyright (C) 2015 Eliot Abrams"
+__license__ = "MIT"
+__version__ = "1.0.0"
+__email__ = "eabrams@uchicago.edu"
+__status__ = "Production"
+
+
+# Packages
+import pandas as pd
+import numpy as np
+import json
+import os
+import BBL.kernel as kernel
+
+# Layout version of the count stores written by save_count_store
+COUNT_STORE_VERSION = 2
+
+# Number of actions (the locations and Other)
+NUM_ACTIONS = len(kernel.action_locations)
+
+
+# Find the year plus week of dates (as in make_states)
+def find_weeks(dates):
+    """
+    Returns the Year_Plus_Week of a Series of dates
+    """
+
+    dates = pd.to_datetime(dates)
+    return (dates.dt.week + dates.dt.year * 52).values
+
+
+# Key the rows of the location data by truck, sub-state and action
+def count_keys(locations_w_states, state_variables, truck_types):
+    """
+    Returns the (truck, sub-state) key of each row (the truck's position in truck_types times
+    SUB_STATE_SPAN plus the sub-state code, as in the policy table) and the (truck, sub-state, action)
+    key (the former times NUM_ACTIONS plus the position of the location in action_locations)
+    """
+
+    codec = kernel.state_codec(state_variables)
+    trucks = pd.Index(truck_types.Truck)
+    plans = np.array([kernel.sub_state_plan(codec, truck) for truck in trucks])
+    truck_rows = trucks.get_indexer(locations_w_states.Truck)
+    state_matrix = np.array(locations_w_states.State.tolist(), dtype=np.int8).reshape(
+        len(locations_w_states), len(state_variables))
+    sub_states = state_matrix[np.arange(len(state_matrix))[:, np.newaxis], plans[truck_rows]]
+
+    state_keys = truck_rows * kernel.SUB_STATE_SPAN + \
+        sub_states.astype(np.int64).dot(kernel.sub_state_multipliers)
+    action_keys = state_keys * NUM_ACTIONS + \
+        pd.Index(kernel.action_locations).get_indexer(locations_w_states.Location)
+
+    return [state_keys, action_keys]
+
+
+# Count the distinct keys
+def count_distinct(keys):
+    """
+    Returns the sorted distinct keys and the number of times each occurs
+    """
+
+    (distinct, inverse) = np.unique(keys, return_inverse=True)
+    return [distinct, np.bincount(inverse, minlength=len(distinct)).astype(np.int64)]
+
+
+# Add counts to sorted arrays of keys and counts
+def add_counts(keys, counts, new_keys, new_counts):
+    """
+    Returns the keys and counts with the new (sorted, distinct) keys and counts added. Counts of
+    keys already present are incremented in place and the rest are inserted in one pass
+    """
+
+    positions = np.searchsorted(keys, new_keys)
+    found = positions < len(keys)
+    found[found] = keys[positions[found]] == new_keys[found]
+    counts[positions[found]] += new_counts[found]
+
+    return [np.insert(keys, positions[~found], new_keys[~found]),
+            np.insert(counts, positions[~found], new_counts[~found])]
+
+
+# Keep the panel rows that later weeks are lagged on
+def find_tail(location_data):
+    """
+    Returns the rows of the last two weeks of the panel (the last week may still be extended by
+    new data, which then needs the week before it)
+    """
+
+    weeks = find_weeks(location_data.Date)
+    tail = location_data[weeks >= weeks.max() - 1]
+    return tail.loc[:, ['Truck', 'Date', 'Location']].reset_index(drop=True)
+
+
+# Build a count store
+def make_count_store(location_data, locations_w_states, state_variables, truck_types):
+    """
+    Takes the panel and the output of make_states() and returns a count store with the numerator
+    and denominator counts of find_probabilities(), the state variables, trucks, discretization
+    thresholds and the final weeks of the panel
+    """
+
+    (state_keys, action_keys) = count_keys(locations_w_states, state_variables, truck_types)
+    (action_keys, action_counts) = count_distinct(action_keys)
+    (state_keys, state_counts) = count_distinct(state_keys)
+
+    return {'action_keys': action_keys,
+            'action_counts': action_counts,
+            'state_keys': state_keys,
+            'state_counts': state_counts,
+            'state_variables': list(state_variables),
+            'truck_types': truck_types.loc[:, ['Truck', 'Type']].reset_index(drop=True),
+            'thresholds': [float(kernel.HIGH_COUNT), float(kernel.HIGH_UNIQUE),
+                           float(kernel.HIGH_FREQ)],
+            'last_date': str(max(location_data.Date)),
+            'tail': find_tail(location_data)}
+
+
+# Add new weeks of data to a count store
+def update_count_store(store, location_data):
+    """
+    Takes the complete panel (Truck, Date, and Location) of the dates after the store's last date,
+    creates their states (lagging on the store's final weeks and discretizing at the store's
+    thresholds) and adds their counts to the store. Returns the new rows with their states and the
+    distinct (truck, sub-state) keys whose probabilities changed. Trucks outside the store are
+    dropped (adding trucks changes the state variables and needs a full rebuild)
+    """
+
+    if (location_data.Date.astype(str) <= store['last_date']).any():
+        raise ValueError('location data must start after the last date in the store, ' +
+                         store['last_date'])
+
+    # Create the states of the new rows from the store's final weeks and the
+    # new data (missing locations have counts of zero as in make_states)
+    location_data = location_data.loc[:, ['Truck', 'Date', 'Location']]
+    if len(location_data) == 0:
+        return [pd.DataFrame(columns=['Truck', 'Location', 'Date', 'State']),
+                np.array([], dtype=np.int64)]
+    window = pd.concat([store['tail'], location_data], ignore_index=True)
+    (kernel.HIGH_COUNT, kernel.HIGH_UNIQUE, kernel.HIGH_FREQ) = store['thresholds']
+    (window_w_states, window_variables) = kernel.make_states(
+        location_data=window, making_probabilities=False, truck_types=store['truck_types'],
+        lag=True)
+    new_rows = window_w_states[(window_w_states.Date > pd.Timestamp(store['last_date'])).values]
+    states = new_rows.reindex(columns=store['state_variables']).fillna(0).values.astype(np.int8)
+    new_rows = new_rows.loc[:, ['Truck', 'Location', 'Date']].reset_index(drop=True)
+    new_rows['State'] = [tuple(state) for state in states.tolist()]
+
+    # Add the counts
+    (state_keys, action_keys) = count_keys(new_rows, store['state_variables'],
+                                           store['truck_types'])
+    (action_keys, action_counts) = count_distinct(action_keys)
+    (store['action_keys'], store['action_counts']) = add_counts(
+        store['action_keys'], store['action_counts'], action_keys, action_counts)
+    (state_keys, state_counts) = count_distinct(state_keys)
+    (store['state_keys'], store['state_counts']) = add_counts(
+        store['state_keys'], store['state_counts'], state_keys, state_counts)
+
+    store['last_date'] = max(store['last_date'], str(max(location_data.Date)))
+    store['tail'] = find_tail(window)
+
+    return [new_rows, state_keys]
+
+
+# Refresh the rows of a policy table from the counts
+def refresh_policy_table(policy_table, store, state_keys=None):
+    """
+    Returns the policy table (see compile_policy_table) with the rows of the given (truck, sub-state)
+    keys set to the log probabilities in the store (all keys and a new table when policy_table is
+    None). Only the given rows are computed and the table's other rows are kept as they are
+    """
+
+    if state_keys is None:
+        state_keys = store['state_keys']
+    num_trucks = len(store['truck_types'])
+    if policy_table is None:
+        log_probabilities = np.empty((1, NUM_ACTIONS))
+        log_probabilities.fill(-np.inf)
+        log_probabilities[-1, :kernel.action_index['Other']] = 0
+        policy_table = {'keys': np.array([np.iinfo(np.int64).max], dtype=np.int64),
+                        'log_probabilities': log_probabilities}
+
+    # Find the counts of the actions in each of the given sub-states (the
+    # actions of a sub-state are consecutive in the store)
+    action_keys = store['action_keys']
+    starts = np.searchsorted(action_keys, state_keys * NUM_ACTIONS)
+    lengths = np.searchsorted(action_keys, (state_keys + 1) * NUM_ACTIONS) - starts
+    entries = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    rows = np.repeat(np.arange(len(state_keys)), lengths)
+    denominators = store['state_counts'][np.searchsorted(store['state_keys'], state_keys)]
+
+    # Calculate the log probabilities
+    log_probabilities = np.empty((len(state_keys), NUM_ACTIONS))
+    log_probabilities.fill(-np.inf)
+    log_probabilities[rows, action_keys[entries] % NUM_ACTIONS] = np.log(
+        store['action_counts'][entries].astype(float) / denominators[rows])
+
+    # Overwrite the rows already in the table and insert the others
+    positions = np.searchsorted(policy_table['keys'], state_keys)
+    found = policy_table['keys'][positions] == state_keys
+    table = np.array(policy_table['log_probabilities'])
+    table[positions[found]] = log_probabilities[found]
+
+    return {'keys': np.insert(policy_table['keys'], positions[~found], state_keys[~found]),
+            'offsets': np.arange(num_trucks, dtype=np.int64) * kernel.SUB_STATE_SPAN,
+            'log_probabilities': np.insert(table, positions[~found], log_probabilities[~found],
+                                           axis=0)}
+
+
+# Store a count store
+def save_count_store(path, store):
+    """
+    Write the counts (as .npy files) and the state variables, trucks, thresholds and final weeks of
+    the panel (in a manifest) to the directory path. The counts and the last date they cover are
+    replaced together (see kernel.save_store), so a crash cannot leave counts that a rerun adds to
+    again
+    """
+
+    tail = store['tail']
+    kernel.save_store(path,
+                      dict((name, store[name]) for name in
+                           ['action_keys', 'action_counts', 'state_keys', 'state_counts']),
+                      {'version': COUNT_STORE_VERSION,
+                       'state_variables': store['state_variables'],
+                       'trucks': list(store['truck_types'].Truck),
+                       'types': list(store['truck_types'].Type),
+                       'locations': kernel.action_locations,
+                       'thresholds': store['thresholds'],
+                       'last_date': store['last_date'],
+                       'tail': {'Truck': list(tail.Truck), 'Date': list(tail.Date.astype(str)),
+                                'Location': list(tail.Location)}})
+
+
+# Read a count store
+def load_count_store(path):
+    """
+    Returns the count store written by save_count_store() and sets the discretization thresholds
+    """
+
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest['version'] != COUNT_STORE_VERSION:
+        raise ValueError('count store ' + path + ' has version ' + str(manifest['version']) +
+                         ', expected ' + str(COUNT_STORE_VERSION))
+    if manifest['locations'] != kernel.action_locations:
+        raise ValueError('count store ' + path + ' was built for other locations')
+
+    # Names come back from json as unicode
+    def names(values):
+        return [value.encode('latin-1') for value in values]
+
+    store = dict((name, np.load(kernel.store_file(path, name, manifest['generation'])))
+                 for name in ['action_keys', 'action_counts', 'state_keys', 'state_counts'])
+    store['state_variables'] = names(manifest['state_variables'])
+    store['truck_types'] = pd.DataFrame({'Truck': names(manifest['trucks']),
+                                         'Type': names(manifest['types'])})[['Truck', 'Type']]
+    store['thresholds'] = manifest['thresholds']
+    store['last_date'] = str(manifest['last_date'])
+    store['tail'] = pd.DataFrame(dict((column, names(manifest['tail'][column]))
+                                      for column in ['Truck', 'Date', 'Location']),
+                                 columns=['Truck', 'Date', 'Location'])
+    (kernel.HIGH_COUNT, kernel.HIGH_UNIQUE, kernel.HIGH_FREQ) = store['thresholds']
+
+    return store
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+"""
+estimation.py: The sympy parameters and profits of the BBL environment
+and the estimation of the parameters from the g(E_{ia}) terms
+"""
+
+__author__ = 'Eliot Abrams'
+__copyright__ = "Copyright (C) 2015 Eliot Abrams"
+__license__ = "MIT"
+__version__ = "1.0.0"
+__email__ = "eabrams@uchicago.edu"
+__status__ = "Production"
+
+# Code adds the symbolic and estimation parts to the BBL environment
+
+# Packages
+import pandas as pd
+import numpy as np
+import sympy as sp
+import scipy.optimize as opt
+import multiprocessing as mp
+from BBL.kernel import *
+
+# Sympy Variables
+
+# Intercept
+intercept = sp.Symbol('intercept')
+
+# Days
+monday = sp.Symbol('monday')
+tuesday = sp.Symbol('tuesday')
+wednesday = sp.Symbol('wednesday')
+thursday = sp.Symbol('thursday')
+friday = sp.Symbol('friday')
+saturday = sp.Symbol('saturday')
+sunday = sp.Symbol('sunday')
+days = [monday, tuesday, wednesday, thursday, friday, saturday, sunday]
+
+# Quarters
+q1 = sp.Symbol('q1')
+q2 = sp.Symbol('q2')
+q3 = sp.Symbol('q3')
+q4 = sp.Symbol('q4')
+quarters = [q1, q2, q3, q4]
+
+# Locations
+CityfrontPlaza = sp.Symbol('CityfrontPlaza')
+ClarkandMonroe = sp.Symbol('ClarkandMonroe')
+LasalleandAdams = sp.Symbol('LasalleandAdams')
+MadisonandWacker = sp.Symbol('MadisonandWacker')
+RandolphandColumbus = sp.Symbol('RandolphandColumbus')
+UniversityofChicago = sp.Symbol('UniversityofChicago')
+WackerandAdams = sp.Symbol('WackerandAdams')
+WestChicagoAvenue = sp.Symbol('WestChicagoAvenue')
+locations = pd.DataFrame(
+    [CityfrontPlaza, ClarkandMonroe, LasalleandAdams, MadisonandWacker,
+     RandolphandColumbus, UniversityofChicago, WackerandAdams,
+     WestChicagoAvenue]).transpose()
+locations.columns = location_names
+
+# Main variables
+high_historic_count = sp.Symbol('high_historic_count')
+high_historic_diversity = sp.Symbol('high_historic_diversity')
+high_historic_freq = sp.Symbol('high_historic_freq')
+high_current_count = sp.Symbol('high_current_count')
+high_current_diversity = sp.Symbol('high_current_diversity')
+
+# The parameters in the order of the kernel's parameter basis
+parameters = [sp.Symbol(name) for name in parameter_names]
+
+
+# Calculate profit given current state and action profile
+def get_profit(location, truck, shock, df, current_variables, truck_types):
+    """
+    Builds the period profit vector for a truck
+    """
+
+    # Zero out profit if chosen location is Other
+    if (location == 'Other'):
+        profit = 0
+
+    # Add intercept, day of week indicator, quarter indicator, and shock. Day
+    # of week is fed in as a 0-6, but quarter is fed in as 1-4 hence the
+    # indexing adjustment for quarter
+
+    else:
+        profit = intercept + \
+            days[df.Day_Of_Week[0]] + quarters[df.Quarter[0] - 1] + shock
+
+        # Add historic count and diversity at chosen location
+        count_var = 'Count' + location
+        num_unique_var = 'Num_Unique' + location
+        profit = profit + df[count_var][0] * high_historic_count + \
+            df[num_unique_var][0] * high_historic_diversity
+
+        # Add truck's historic frequency at chosen location
+        historic_freq_var = location + str(truck)
+        profit = profit + df[historic_freq_var][0] * high_historic_freq
+
+        # Add current location variables
+        profit = profit + locations[location][0] + current_variables.Count[location] * \
+            high_current_count + \
+            current_variables.Num_Unique[location] * high_current_diversity
+
+    return profit
+
+
+# Turn a coefficient vector (or a numeric value function) back into a sympy
+# expression
+def to_expression(coefficients):
+    """
+    Returns the sympy expression corresponding to a vector of coefficients on the parameters
+    """
+
+    expression = sp.Float(coefficients[SHOCK])
+    for (parameter, coefficient) in zip(parameters, coefficients[:NUM_PARAMETERS]):
+        if coefficient != 0:
+            expression += coefficient * parameter
+
+    return expression
+
+
+# Minimize the objective over compiled g terms
+def minimize_g(G, c, initial_guess, method='L-BFGS-B'):
+    """
+    Minimize sum(Min(G * theta + c, 0) ** 2) over theta starting from initial_guess
+    """
+
+    def function(values):
+        violations = np.minimum(G.dot(values) + c, 0)
+        return violations.dot(violations)
+
+    def gradient(values):
+        violations = np.minimum(G.dot(values) + c, 0)
+        return 2 * G.T.dot(violations)
+
+    # Derivative free methods do not take the gradient
+    if method.lower() in ['nelder-mead', 'powell']:
+        jac = None
+    else:
+        jac = gradient
+
+    return opt.minimize(function, initial_guess, method=method, jac=jac)
+
+
+# Solve a bootstrap replicate
+def solve_replicate(G, c, point_estimate, method='L-BFGS-B'):
+    """
+    Minimize the objective over a resample's compiled g terms, starting from the point estimate
+    when it violates some of the resample's inequalities and else from the initial guess of
+    optimize() (a point estimate that already solves the resample would be returned unchanged)
+    """
+
+    violations = np.minimum(G.dot(point_estimate) + c, 0)
+    if violations.dot(violations) > 0:
+        return minimize_g(G, c, point_estimate, method)
+
+    return minimize_g(G, c, np.ones(len(point_estimate)), method)
+
+
+# Estimate the parameters by maximizing the objective
+def optimize(g, method='L-BFGS-B', starts=1):
+    """
+    Find parameters by optimizing over the given table of estimated inequalities
+    (starts > 1 restarts the solver from random perturbations of the initial guess and keeps the best)
+    """
+
+    # Drop the parameters that do not appear in any term
+    (G, c) = compile_g(g)
+    used = (G != 0).any(axis=0)
+    G = G[:, used]
+    variables = [parameter for (parameter, x) in zip(parameters, used) if x]
+
+    # Create the intial guesses
+    initial_guess = np.ones(len(variables))
+    guesses = [initial_guess] + [initial_guess + np.random.normal(size=len(variables))
+                                 for x in xrange(starts - 1)]
+
+    # Optimize!
+    results = [minimize_g(G, c, guess, method) for guess in guesses]
+    best = min(results, key=lambda res: res.fun)
+
+    return [best, variables]
+
+
+# Set up a bootstrap worker process
+def initialize_bootstrap_worker(inputs):
+    """
+    Store the compiled g terms, point estimate and method shared by all replicates
+    """
+
+    worker_inputs.update(inputs)
+
+
+# Solve one bootstrap replicate in a worker process
+def bootstrap_task(rows):
+    """
+    Minimize the objective over the given rows of the worker's compiled g terms
+    """
+
+    res = solve_replicate(worker_inputs['G'][rows], worker_inputs['c'][rows],
+                          worker_inputs['point_estimate'], worker_inputs['method'])
+    return list(res.x) + [res.success]
+
+
+# Bootstrap the parameter estimates
+def bootstrap(g, replications, size=None, method='L-BFGS-B', processes=None):
+    """
+    Re-estimate the parameters on replications resamples (of size terms, all by default) of the
+    table of estimated inequalities. The g terms are compiled once, the resamples are all drawn up
+    front and a replicate starts from the point estimate unless it solves the resample (see
+    solve_replicate). processes solves the replicates on a
+    pool of worker processes. Returns the point estimate and a table with a row per replicate
+    """
+
+    # Get the point estimate (the replicates keep its parameters so that
+    # their rows line up)
+    (point_estimate, variables) = optimize(g, method=method)
+    (G, c) = compile_g(g)
+    G = G[:, np.array([parameter in variables for parameter in parameters])]
+
+    # Draw the resamples
+    if size is None:
+        size = len(g)
+    samples = np.random.randint(0, len(g), size=(replications, size))
+
+    # Solve the replicates
+    inputs = {'G': G, 'c': c, 'point_estimate': point_estimate.x, 'method': method}
+    if processes is None:
+        results = [solve_replicate(G[rows], c[rows], point_estimate.x, method) for rows in samples]
+        results = [list(res.x) + [res.success] for res in results]
+    else:
+        pool = mp.Pool(processes, initializer=initialize_bootstrap_worker, initargs=(inputs,))
+        try:
+            results = pool.map(bootstrap_task, list(samples))
+            pool.close()
+
+        # Stop the workers rather than leaving them running
+        except:
+            pool.terminate()
+            raise
+
+        finally:
+            pool.join()
+
+    bootstrap_results = pd.DataFrame(results, columns=variables + ['Converged'])
+
+    return [point_estimate, bootstrap_results]
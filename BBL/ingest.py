@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""
+ingest.py: Reads the scraped location data in chunks and applies the
+cleaning of createdata.py to each chunk so that panels larger than memory
+can be cleaned
+"""
+
+__author__ = 'Eliot Abrams'
+__copyright__ = "Copyright (C) 2015 Eliot Abrams"
+__license__ = "MIT"
+__version__ = "1.0.0"
+__email__ = "eabrams@uchicago.edu"
+__status__ = "Production"
+
+
+# Packages
+import pandas as pd
+import numpy as np
+import datetime as dt
+
+# Parkings outside of the city
+non_city_locations = ['Schaumburg Area', '1815 South Meyers Road, Oakbrook Terrace, IL']
+
+
+# Find the hour of each time (parsing each distinct time once)
+def parse_hours(times):
+    """
+    Takes a Series of times such as 11:00 AM and returns the hours on a 24 hour clock (NaN for
+    missing times, which are then neither before nor after any hour)
+    """
+
+    times = times.astype('category')
+    hours = np.array([dt.datetime.strptime(time, '%I:%M %p').hour
+                      for time in times.cat.categories], dtype=float)
+
+    # Missing times have the code -1, which picks the NaN appended last
+    hours = np.append(hours, np.nan)
+    return pd.Series(hours[np.asarray(times.cat.codes)], index=times.index)
+
+
+# Clean one chunk of the location data
+def clean_chunk(chunk, trucks, first_year=2014):
+    """
+    Keep the weekday parkings from first_year on (returning them as the parkings that count
+    towards each truck's total) and the lunch time parkings of the given trucks in the city
+    """
+
+    # Drop old data and weekends
+    dates = pd.to_datetime(chunk.Date)
+    keep = (dates.dt.year >= first_year) & (dates.dt.weekday < 5)
+    chunk = chunk[keep.values]
+    counted = chunk.Truck
+
+    # Drop other trucks and non-city and non-lunch parkings (note that time is
+    # converted to 24 hour clock)
+    chunk = chunk[chunk.Truck.isin(trucks) & ~chunk.Location.isin(non_city_locations)]
+    chunk = chunk[((parse_hours(chunk.Start_Time) < 12) &
+                   (parse_hours(chunk.End_Time) > 12)).values]
+
+    return [chunk[['Location', 'Truck', 'Date']], counted]
+
+
+# Stream the location data through the cleaning
+def ingest_locations(path, trucks, output=None, chunksize=100000, first_year=2014, min_parkings=67):
+    """
+    Read the location data at path in chunks of chunksize rows and return the cleaned panel of
+    Location, Truck, and Date (also written to output if given). Keeps the first parking of each
+    truck on each date and the trucks with at least min_parkings weekday parkings from first_year on.
+    Only the kept parkings are held in memory, coded against the distinct values of each column
+    """
+
+    trucks = set(trucks)
+    truck_counts = pd.Series()
+    seen = set()
+    categories = {'Location': {}, 'Truck': {}, 'Date': {}}
+    columns = {'Location': [], 'Truck': [], 'Date': []}
+    for chunk in pd.read_csv(path, index_col=0, chunksize=chunksize,
+                             dtype={'Location': str, 'Truck': str, 'Start_Time': str,
+                                    'End_Time': str, 'Date': str}):
+        (chunk, counted) = clean_chunk(chunk, trucks, first_year)
+        truck_counts = truck_counts.add(counted.value_counts(), fill_value=0)
+
+        # Because of data errors there are truck, date duplicates (that can
+        # span chunks)
+        chunk = chunk.drop_duplicates(['Truck', 'Date'])
+        keys = list(zip(chunk.Truck, chunk.Date))
+        chunk = chunk[np.array([key not in seen for key in keys], dtype=bool)]
+        seen.update(keys)
+
+        # Keep the columns as codes into the categories seen so far
+        for column in ['Location', 'Truck', 'Date']:
+            codes = categories[column]
+            for value in chunk[column].unique():
+                codes.setdefault(value, len(codes))
+            columns[column].append(chunk[column].map(codes).values.astype(np.int32))
+
+    # Assemble the panel
+    for column in ['Location', 'Truck', 'Date']:
+        names = np.array(sorted(categories[column], key=categories[column].get), dtype=object)
+        columns[column] = names[np.concatenate(columns[column] + [np.array([], dtype=np.int32)])]
+    location_data = pd.DataFrame(columns, columns=['Location', 'Truck', 'Date'])
+
+    # Drop rare trucks
+    common = truck_counts[truck_counts >= min_parkings].index
+    location_data = location_data[location_data.Truck.isin(common)].reset_index(drop=True)
+
+    if output is not None:
+        location_data.to_csv(output)
+
+    return location_data
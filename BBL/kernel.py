@@ -0,0 +1,1742 @@
+#!/usr/bin/env python
+
+"""
+kernel.py: Code sets up the BBL environment for a simulation involving 
+the locations of Chicago food trucks (the states, policies and simulations,
+which only need numpy and pandas)
+"""
+
+__author__ = 'Eliot Abrams'
+__copyright__ = "Copyright (C) 2015 Eliot Abrams"
+__license__ = "MIT"
+__version__ = "1.0.0"
+__email__ = "eabrams@uchicago.edu"
+__status__ = "Production"
+
+
+# Code sets up the BBL environment
+
+# Packages
+import pandas as pd
+import numpy as np
+import datetime as dt
+import multiprocessing as mp
+import cPickle as pickle
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import functools
+import collections
+
+# Constants
+HIGH_COUNT = 0
+HIGH_UNIQUE = 0
+HIGH_FREQ = 0
+
+# Parameter names (see BBL.estimation for the matching sympy symbols)
+
+# Days
+day_names = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+# Quarters
+quarter_names = ['q1', 'q2', 'q3', 'q4']
+
+# Locations
+location_names = ['CityfrontPlaza', 'ClarkandMonroe', 'LasalleandAdams',
+                  'MadisonandWacker', 'RandolphandColumbus',
+                  'UniversityofChicago', 'WackerandAdams',
+                  'WestChicagoAvenue']
+
+# Actions (the locations plus the catch-all Other location)
+action_locations = list(location_names) + ['Other']
+action_index = dict((location, i) for (i, location) in enumerate(action_locations))
+
+# Sub-states are coded as integers in mixed radix (the truck's frequencies,
+# counts, and diversities are dummies, then come the quarter and day of week)
+sub_state_radix = np.array([2] * (3 * len(location_names)) + [5, 7])
+sub_state_multipliers = np.concatenate(
+    [[1], np.cumprod(sub_state_radix[:-1])]).astype(np.int64)
+SUB_STATE_SPAN = int(np.prod(sub_state_radix.astype(np.int64)))
+
+# Cache of the column index plans for each list of state variables
+state_codecs = {}
+
+# Layout version of the artifact bundles written by save_bundle
+BUNDLE_VERSION = 2
+
+# Inputs shared by the tasks of a worker process
+worker_inputs = {}
+
+# Metrics of the current run (None while instrumentation is disabled, see
+# enable_instrumentation)
+metrics = None
+
+# Main variables
+variable_names = ['high_historic_count', 'high_historic_diversity', 'high_historic_freq',
+                  'high_current_count', 'high_current_diversity']
+
+# Parameter basis for the numeric profit engine. Profit is linear in the
+# parameters, so a truck's (discounted) profit can be stored as a vector of
+# coefficients over this basis with the shock carried in one final column
+parameter_names = ['intercept'] + day_names + quarter_names + location_names + variable_names
+parameter_index = dict((p, i) for (i, p) in enumerate(parameter_names))
+NUM_PARAMETERS = len(parameter_names)
+SHOCK = NUM_PARAMETERS
+day_parameters = np.array([parameter_index[day] for day in day_names])
+quarter_parameters = np.array([parameter_index[quarter] for quarter in quarter_names])
+location_parameters = np.array([parameter_index[location] for location in location_names])
+
+
+# Start recording metrics
+def enable_instrumentation():
+    """
+    Start (or restart) recording the time spent in the instrumented functions and the simulation
+    counters (policy hits and random fallbacks, weekly transitions, simulated days and paths)
+    """
+
+    global metrics
+    metrics = {'seconds': {}, 'calls': {}, 'counters': {}, 'fallbacks': {}}
+
+
+# Stop recording metrics
+def disable_instrumentation():
+    """
+    Stop recording and return the metrics recorded since enable_instrumentation() (with the random
+    fallbacks as counts by truck and sub-state, written as in probabilities.csv)
+    """
+
+    global metrics
+    (recorded, metrics) = (metrics, None)
+    if recorded is not None:
+        fallback_sub_states = {}
+        for ((truck, code), number) in recorded.pop('fallbacks').items():
+            sub_state = str(((code // sub_state_multipliers) % sub_state_radix).tolist())
+            fallback_sub_states.setdefault(truck, {})[sub_state] = number
+        recorded['fallback_sub_states'] = fallback_sub_states
+    return recorded
+
+
+# Add metrics recorded elsewhere (e.g. in a worker process) to the current run
+def merge_metrics(recorded):
+    """
+    Add the recorded metrics to the current metrics (if instrumentation is enabled)
+    """
+
+    if metrics is None or recorded is None:
+        return
+    for group in ['seconds', 'calls', 'counters', 'fallbacks']:
+        for (name, value) in recorded[group].items():
+            metrics[group][name] = metrics[group].get(name, 0) + value
+
+
+# Write metrics as JSON
+def write_metrics(path, recorded):
+    """
+    Write the recorded metrics to path as JSON
+    """
+
+    with open(path, 'w') as f:
+        json.dump(recorded, f, indent=2, sort_keys=True, encoding='latin-1')
+
+
+# Add to a counter
+def count(name, value=1):
+    """
+    Add value to the named counter (if instrumentation is enabled)
+    """
+
+    if metrics is not None:
+        metrics['counters'][name] = metrics['counters'].get(name, 0) + int(value)
+
+
+# Count the sub-states that fell back to random actions
+def count_fallbacks(trucks, keys):
+    """
+    Add one fallback for each key (the truck's position in trucks times SUB_STATE_SPAN plus the
+    sub-state code, as in compile_policy_table) if instrumentation is enabled
+    """
+
+    if metrics is None:
+        return
+    (keys, numbers) = np.unique(np.asarray(keys, dtype=np.int64), return_counts=True)
+    fallbacks = metrics['fallbacks']
+    for (key, number) in zip(keys.tolist(), numbers.tolist()):
+        key = (trucks[key // SUB_STATE_SPAN], key % SUB_STATE_SPAN)
+        fallbacks[key] = fallbacks.get(key, 0) + number
+
+
+# Time the calls of a function
+def instrumented(function):
+    """
+    Decorator that adds the time spent in (and the number of calls of) function to the metrics
+    while instrumentation is enabled
+    """
+
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if metrics is None:
+            return function(*args, **kwargs)
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            metrics['seconds'][name] = metrics['seconds'].get(name, 0) + time.time() - start
+            metrics['calls'][name] = metrics['calls'].get(name, 0) + 1
+
+    return wrapper
+
+
+# Create states as a tuple and add as a column to the input location data
+@instrumented
+def make_states(location_data, making_probabilities, truck_types, quantile=0.8, lag=None):
+    """
+    Takes DataFrame with Truck, Location, and Date and returns DataFrame with created states and also state variables
+    (when making probabilities the variables are discretized at the given quantile). lag sets whether the variables
+    are lagged a week (by default only when making probabilities)
+    """
+
+    if lag is None:
+        lag = making_probabilities
+
+    # Merge on truck types
+    location_data = pd.merge(location_data, truck_types, on='Truck')
+
+    # Create time variables (most of the state variables are at the week level)
+    location_data['Date'] = pd.to_datetime(location_data['Date'])
+    location_data['Year_Plus_Week'] = location_data[
+        'Date'].dt.week + location_data['Date'].dt.year * 52
+    location_data['Day_Of_Week'] = location_data['Date'].dt.dayofweek
+    location_data['Quarter'] = location_data['Date'].dt.quarter
+
+    # Find the number and diversity of trucks at each location in each week
+    grouped_by_year_plus_week_location = location_data.groupby(
+        ['Year_Plus_Week', 'Location'])
+    joint_state_variables = grouped_by_year_plus_week_location.Type.agg(['count', 'nunique']).reset_index(
+        ['Location', 'Year_Plus_Week']).rename(columns={'count': 'Count', 'nunique': 'Num_Unique'})
+    joint_state_variables = joint_state_variables[
+        joint_state_variables.Location != 'Other']
+
+    # Create the quantiles for discretizing
+    if making_probabilities:
+        global HIGH_COUNT
+        global HIGH_UNIQUE
+        HIGH_COUNT = joint_state_variables.quantile(q=quantile, axis=0)[1]
+        HIGH_UNIQUE = joint_state_variables.quantile(q=quantile, axis=0)[2]
+
+    # Discretize the values (turn into dummy variables for now).
+    joint_state_variables.Count = joint_state_variables.Count.apply(
+        lambda row: int(row >= HIGH_COUNT))
+    joint_state_variables.Num_Unique = joint_state_variables.Num_Unique.apply(
+        lambda row: int(row >= HIGH_UNIQUE))
+
+    # Form the pivot table
+    joint_state_variables = pd.pivot_table(joint_state_variables,
+                                           values=['Count', 'Num_Unique'],
+                                           index='Year_Plus_Week',
+                                           columns='Location').fillna(0).reset_index(['Year_Plus_Week', 'Count', 'Num_Unique'])
+
+    # Collapse the multiple indices
+    joint_state_variables.columns = pd.Index(
+        [e[0] + e[1] for e in joint_state_variables.columns.tolist()])
+
+    # Find the frequency with which each truck parks at each location_data
+    truck_specific_state_variables = location_data.groupby(['Truck', 'Year_Plus_Week', 'Location'])['Date'].count(
+    ).reset_index(['Truck', 'Location', 'Year_Plus_Week']).rename(columns={'Date': 'Truck_Weekly_Frequency'})
+    truck_specific_state_variables = truck_specific_state_variables[
+        truck_specific_state_variables.Location != 'Other']
+
+    # Create the quantiles for discretizing
+    if making_probabilities:
+        global HIGH_FREQ
+        HIGH_FREQ = truck_specific_state_variables.quantile(q=quantile, axis=0)[1]
+
+    # Discretize the values (turn into dummy variables for now).
+    truck_specific_state_variables.Truck_Weekly_Frequency = truck_specific_state_variables.Truck_Weekly_Frequency.apply(
+        lambda row: int(row > HIGH_FREQ))
+
+    # Create container table table (to ensure that all truck location
+    # combinations are present)
+    container_table = truck_types.drop('Type', axis=1)
+    temp = pd.DataFrame(list(location_names), columns=['Location'])
+    container_table['key'] = 1
+    temp['key'] = 1
+    container_table = pd.merge(
+        container_table, temp, on='key').ix[:, ('Truck', 'Location')]
+
+    # Finish the pivot table
+    truck_specific_state_variables = truck_specific_state_variables.append(
+        container_table).fillna(0)
+    historic_truck_frequencies = pd.pivot_table(truck_specific_state_variables,
+                                                values='Truck_Weekly_Frequency',
+                                                index='Year_Plus_Week',
+                                                columns=['Location', 'Truck']).fillna(0).reset_index()
+
+    # Collapse the multiple indices
+    historic_truck_frequencies.columns = pd.Index(
+        [e[0] + str(e[1]) for e in historic_truck_frequencies.columns.tolist()])
+
+    # If making the probabilities from the original location
+    # data merge state variables onto the location data on with a lag
+    if lag:
+        joint_state_variables.Year_Plus_Week += 1
+        historic_truck_frequencies.Year_Plus_Week += 1
+
+    # Else just merge (note that observations that are not matched are being
+    # dropped)
+    new_vars = pd.merge(
+        joint_state_variables, historic_truck_frequencies, on=['Year_Plus_Week'])
+    location_data = pd.merge(
+        location_data, new_vars, on=['Year_Plus_Week'])
+
+    # Concatenate the created variables into a single state variable
+    location_data = location_data.reindex_axis(
+        sorted(location_data.columns), axis=1)
+    state_variables = location_data.columns.tolist()
+    state_variables.remove('Truck')
+    state_variables.remove('Date')
+    state_variables.remove('Location')
+    state_variables.remove('Type')
+    state_variables.remove('Year_Plus_Week')
+
+    # Store as tuple
+    location_data['State'] = location_data[state_variables].values.tolist()
+    location_data.State = location_data.State.apply(tuple)
+
+    return [location_data, state_variables]
+
+
+# Store a state as a small integer array
+def encode_state(state):
+    """
+    Returns the state as an array of small integers (all state variables are dummies or day and quarter indicators)
+    """
+
+    return np.array(state, dtype=np.int8)
+
+
+# Find the column index plans for the given state variables
+def state_codec(state_variables):
+    """
+    Returns a dictionary with the position of each state variable and the (lazily built) sub-state plan for each truck
+    """
+
+    key = tuple(state_variables)
+    if key not in state_codecs:
+        state_codecs[key] = {
+            'index': dict((variable, i) for (i, variable) in enumerate(state_variables)),
+            'plans': {}}
+
+    return state_codecs[key]
+
+
+# List the state variables that make up a truck's sub-state
+def sub_state_variables(truck):
+    """
+    Returns the names of the state variables in the portion of the state that the truck acts on
+    """
+
+    return [location + truck for location in location_names] + \
+        ['Count' + location for location in location_names] + \
+        ['Num_Unique' + location for location in location_names] + \
+        ['Quarter', 'Day_Of_Week']
+
+
+# Find the positions of a truck's sub-state within the state
+def sub_state_plan(codec, truck):
+    """
+    Returns the array of state positions that make up the truck's sub-state
+    """
+
+    if truck not in codec['plans']:
+        codec['plans'][truck] = np.array(
+            [codec['index'][variable] for variable in sub_state_variables(truck)])
+
+    return codec['plans'][truck]
+
+
+# Code a sub-state (array or stringified list) as a single integer
+def sub_state_code(sub_state):
+    """
+    Returns the mixed radix integer code of the sub-state
+    """
+
+    if isinstance(sub_state, str):
+        sub_state = np.fromstring(sub_state[1:-1], dtype=np.int64, sep=',')
+
+    return int(np.dot(sub_state, sub_state_multipliers))
+
+
+# Extract the portion of the state that the truck acts on
+def extract_sub_state(state, truck, state_variables):
+    """
+    Extract pull out the portion of the state that the truck acts on (as a string for storing in tables)
+    """
+
+    plan = sub_state_plan(state_codec(state_variables), truck)
+    return str([int(x) for x in np.asarray(state)[plan]])
+
+
+# Extract the portion of the state that the truck acts on as an integer code
+def encode_sub_state(state, truck, state_variables):
+    """
+    Extract the portion of the state that the truck acts on and return its integer code
+    """
+
+    plan = sub_state_plan(state_codec(state_variables), truck)
+    return int(np.dot(np.asarray(state)[plan], sub_state_multipliers))
+
+
+# Calculate P(a_{it} | s_t)
+@instrumented
+def find_probabilities(locations_w_states, state_variables):
+    """
+    Takes DataFrame with Truck, Location, Date, and State and returns DataFrame with action probabilities
+    """
+
+    # Create sub_states for all rows at once (each row gathers the columns in
+    # its truck's sub-state plan)
+    codec = state_codec(state_variables)
+    (truck_codes, trucks) = pd.factorize(locations_w_states.Truck)
+    (location_codes, observed_locations) = pd.factorize(locations_w_states.Location)
+    plans = np.array([sub_state_plan(codec, truck) for truck in trucks])
+    state_matrix = np.array(locations_w_states.State.tolist(), dtype=np.int8)
+    sub_states = state_matrix[
+        np.arange(len(state_matrix))[:, np.newaxis], plans[truck_codes]]
+
+    # Code the sub_states as integers and only stringify the distinct ones
+    (unique_codes, first_rows, sub_state_codes) = np.unique(
+        sub_states.astype(np.int64).dot(sub_state_multipliers),
+        return_index=True, return_inverse=True)
+    sub_state_names = np.array(
+        [str(sub_state) for sub_state in sub_states[first_rows].tolist()], dtype=object)
+    locations_w_states['Sub_States'] = sub_state_names[sub_state_codes]
+
+    # Find the number of times that each truck takes each action for each state
+    numerator = pd.DataFrame({'Truck': truck_codes,
+                              'Location': location_codes,
+                              'Sub_States': sub_state_codes}).groupby(
+        ['Truck', 'Location', 'Sub_States']).size()
+
+    # Find the number of times that each state occurs (the sum over actions)
+    denominator = numerator.groupby(level=['Truck', 'Sub_States']).transform('sum')
+
+    # Calculate the probabilities
+    probabilities = numerator.reset_index().loc[:, ['Truck', 'Location', 'Sub_States']]
+    probabilities['Truck'] = np.asarray(trucks)[probabilities.Truck.values]
+    probabilities['Location'] = np.asarray(observed_locations)[probabilities.Location.values]
+    probabilities['Sub_States'] = sub_state_names[probabilities.Sub_States.values]
+    probabilities['Probability'] = numerator.values.astype(float) / denominator.values
+
+    return probabilities.sort(['Truck', 'Location', 'Sub_States']).reset_index(drop=True)
+
+
+# Index the probabilities by truck and sub-state for fast lookup
+def compile_policy(probabilities):
+    """
+    Takes the Probability DataFrame and returns a dictionary mapping (truck, sub-state code) to an array
+    of location codes (positions in action_locations) and an array of log probabilities
+    """
+
+    # Already compiled (a policy table, as in a bundle, cannot be looked up by
+    # truck and sub-state)
+    if isinstance(probabilities, dict):
+        if 'log_probabilities' in probabilities:
+            raise ValueError('compile_policy takes the Probability DataFrame or its own output, '
+                             'not a policy table (simulate with numeric=True to use a bundle)')
+        return probabilities
+
+    policy = {}
+    for ((truck, sub_state), group) in probabilities.groupby(['Truck', 'Sub_States']):
+        policy[(truck, sub_state_code(sub_state))] = (
+            np.array([action_index[location] for location in group.Location]),
+            np.log(group.Probability.values.astype(float)))
+
+    return policy
+
+
+# Find vector of optimal action from probability list and state
+@instrumented
+def optimal_action(probability_list, state, truck_types, state_variables):
+    """
+    Find optimal actions for the trucks at the given state from the Probability DataFrame
+    (or from the policy returned by compile_policy(), which should be preferred in loops)
+    """
+
+    policy = compile_policy(probability_list)
+    random_actions = None
+    action_profile = []
+    for truck in truck_types.Truck:
+        code = encode_sub_state(state=state, truck=truck, state_variables=state_variables)
+        entry = policy.get((truck, code))
+
+        # If the state is not present in the historic data then generate random
+        # actions for the trucks
+        if entry is None:
+            if random_actions is None:
+                random_actions = generate_random_actions(truck_types)
+            action_profile.append(
+                random_actions[random_actions.Truck == truck].values[0].tolist())
+            count('random_fallbacks')
+            count_fallbacks([truck], [code])
+
+        # If the state is present, find the optimal action using the Hotz-Miller
+        # inversion (the largest log probability plus shock)
+        else:
+            (location_codes, log_probabilities) = entry
+            count('policy_hits')
+            shocks = np.random.gumbel(
+                loc=0.0, scale=1.0, size=len(location_codes))
+            best = np.argmax(log_probabilities + shocks)
+            action_profile.append(
+                [truck, action_locations[location_codes[best]], shocks[best]])
+
+    action_profile = pd.DataFrame(
+        action_profile, columns=['Truck', 'Location', 'Shock'])
+
+    return action_profile.sort('Truck')
+
+
+# Find other actions (for now just enable acting randomly and acting certainly)
+def generate_random_actions(truck_types):
+    """
+    Find random actions for the trucks
+    """
+
+    # Create a table with all possible actions for all trucks
+    action_profile = truck_types.drop('Type', axis=1)
+    temp = pd.DataFrame(list(location_names), columns=['Location'])
+    action_profile['key'] = 1
+    temp['key'] = 1
+    comparison = pd.merge(action_profile, temp, on='key').ix[
+        :, ('Truck', 'Location')]
+
+    # Generate a random shock
+    comparison['Shock'] = np.random.gumbel(
+        loc=0.0, scale=1.0, size=len(comparison.index))
+
+    # Return best action for truck (the economics is that I'm putting a null
+    # prior over each action and so the action taken according to the
+    # Hotz-Miller inversion is just the action with the highest shock value)
+    action_profile = comparison.sort('Shock', ascending=False).drop_duplicates(
+        'Truck').loc[:, ['Truck', 'Location', 'Shock']]
+
+    return action_profile
+
+
+def generate_certain_actions(certain_action, truck_types):
+    """
+    Returns table with specified action for trucks
+    """
+
+    action_profile = truck_types.drop('Type', axis=1)
+    action_profile['Location'] = certain_action
+    action_profile['Shock'] = np.random.gumbel(
+        loc=0.0, scale=1.0, size=len(action_profile.index))
+
+    return action_profile
+
+
+# Builds the current period variables and runs the get_profit() vector for each of the trucks
+# this function is currently specific to the food truck location application
+# but could be made more general. Also, it would be nice to do the discretizing
+# of the current period variables through a call to another function
+@instrumented
+def create_profit_vector(state_variables, state, actions, truck_types):
+    """
+    Creates the current period variables and then calls get_profit() for each truck
+    """
+
+    # Put into data frame
+    df = pd.DataFrame([state]).applymap(int)
+    df.columns = state_variables
+
+    # Create variables based on current actions
+    actions = pd.merge(actions, truck_types, on='Truck')
+    current_variables = actions.groupby(['Location'])['Type'].agg(
+        ['count', 'nunique']).rename(columns={'count': 'Count', 'nunique': 'Num_Unique'})
+
+    # Discretize the values (turn into dummy variables for now).
+    current_variables.Count = current_variables.Count.apply(
+        lambda row: int(row >= HIGH_COUNT))
+    current_variables.Num_Unique = current_variables.Num_Unique.apply(
+        lambda row: int(row >= HIGH_UNIQUE))
+
+    # Create profit vector (the symbolic profits live with the estimation code)
+    from BBL.estimation import get_profit
+    Profit_Vector = actions.drop(['Type'], 1)
+    Profit_Vector['Profit'] = Profit_Vector.apply(lambda row: get_profit(
+        row['Location'], row['Truck'], row['Shock'], df, current_variables, truck_types), axis=1)
+
+    return Profit_Vector.drop(['Location', 'Shock'], 1)
+
+
+# Numeric version of get_profit()
+def get_profit_coefficients(location, truck, shock, state, codec, current_variables):
+    """
+    Builds the period profit of a truck as coefficients on the parameters (with the shock in the final entry)
+    """
+
+    coefficients = np.zeros(NUM_PARAMETERS + 1)
+    index = codec['index']
+
+    # Zero out profit if chosen location is Other
+    if (location == 'Other'):
+        return coefficients
+
+    # Intercept, day of week, quarter, and shock (same indexing as get_profit)
+    coefficients[parameter_index['intercept']] = 1
+    coefficients[parameter_index[day_names[state[index['Day_Of_Week']]]]] = 1
+    coefficients[parameter_index[quarter_names[state[index['Quarter']] - 1]]] = 1
+    coefficients[SHOCK] = shock
+
+    # Historic count and diversity at chosen location and the truck's
+    # historic frequency at chosen location
+    coefficients[parameter_index['high_historic_count']] = state[
+        index['Count' + location]]
+    coefficients[parameter_index['high_historic_diversity']] = state[
+        index['Num_Unique' + location]]
+    coefficients[parameter_index['high_historic_freq']] = state[
+        index[location + str(truck)]]
+
+    # Current location variables
+    coefficients[parameter_index[location]] = 1
+    coefficients[parameter_index['high_current_count']] = current_variables.Count[
+        location]
+    coefficients[parameter_index['high_current_diversity']] = current_variables.Num_Unique[
+        location]
+
+    return coefficients
+
+
+# Numeric version of create_profit_vector(). Rows of the returned matrix follow
+# the order of truck_types so that they can be accumulated with vector adds
+@instrumented
+def create_profit_matrix(state_variables, state, actions, truck_types):
+    """
+    Creates the current period variables and returns a matrix with get_profit_coefficients() for each truck
+    """
+
+    # Encode the state and find the positions of the state variables
+    state = encode_state(state)
+    codec = state_codec(state_variables)
+
+    # Create variables based on current actions
+    actions = pd.merge(actions, truck_types, on='Truck')
+    current_variables = actions.groupby(['Location'])['Type'].agg(
+        ['count', 'nunique']).rename(columns={'count': 'Count', 'nunique': 'Num_Unique'})
+
+    # Discretize the values (turn into dummy variables for now).
+    current_variables.Count = current_variables.Count.apply(
+        lambda row: int(row >= HIGH_COUNT))
+    current_variables.Num_Unique = current_variables.Num_Unique.apply(
+        lambda row: int(row >= HIGH_UNIQUE))
+
+    # Create profit matrix
+    truck_rows = dict((truck, row) for (row, truck) in enumerate(truck_types.Truck))
+    Profit_Matrix = np.zeros((len(truck_types), NUM_PARAMETERS + 1))
+    for (location, truck, shock) in zip(actions.Location, actions.Truck, actions.Shock):
+        Profit_Matrix[truck_rows[truck]] = get_profit_coefficients(
+            location, truck, shock, state, codec, current_variables)
+
+    return Profit_Matrix
+
+
+# Positions of the variables that the batched simulation reads and writes
+def make_simulation_plan(state_variables, truck_types):
+    """
+    Returns a dictionary with the state positions of the sub-states, counts, diversities, and
+    frequencies for the trucks (in truck_types order) and an indicator matrix of the truck types
+    """
+
+    codec = state_codec(state_variables)
+    index = codec['index']
+    trucks = list(truck_types.Truck)
+    (type_codes, type_names) = pd.factorize(truck_types.Type)
+
+    return {'trucks': trucks,
+            'sub_states': np.array([sub_state_plan(codec, truck) for truck in trucks]),
+            'count': np.array([index['Count' + location] for location in location_names]),
+            'unique': np.array([index['Num_Unique' + location] for location in location_names]),
+            'frequency': np.array([[index[location + str(truck)] for location in location_names]
+                                   for truck in trucks]),
+            'quarter': index['Quarter'],
+            'day_of_week': index['Day_Of_Week'],
+            'types': np.eye(len(type_names))[type_codes]}
+
+
+# Running tallies of the week's actions on every path
+def new_week(num_paths, plan):
+    """
+    Returns empty weekly counts, type sets, and truck frequencies for each location on each path
+    """
+
+    return {'count': np.zeros((num_paths, len(location_names))),
+            'types': np.zeros((num_paths, len(location_names), plan['types'].shape[1]), dtype=bool),
+            'frequency': np.zeros((num_paths, len(plan['trucks']), len(location_names)))}
+
+
+def accumulate_week(week, actions, plan):
+    """
+    Adds a day of actions (paths by trucks by action_locations indicators) to the weekly tallies
+    """
+
+    # Parkings at Other do not enter the state
+    actions = actions[:, :, :len(location_names)]
+    week['count'] += actions.sum(axis=1)
+    week['types'] |= np.dot(actions.transpose(0, 2, 1), plan['types']) > 0
+    week['frequency'] += actions
+
+
+# Close the week on every path
+@instrumented
+def end_week(states, week, plan):
+    """
+    Writes the discretized weekly variables into the states (as make_states would) and resets the tallies
+    """
+
+    # Locations and trucks that were never observed during the week are zero
+    # in make_states regardless of the thresholds
+    unique = week['types'].sum(axis=2)
+    states[:, plan['count']] = (week['count'] >= HIGH_COUNT) & (week['count'] > 0)
+    states[:, plan['unique']] = (unique >= HIGH_UNIQUE) & (unique > 0)
+    states[:, plan['frequency'].ravel()] = (
+        (week['frequency'] > HIGH_FREQ) & (week['frequency'] > 0)).reshape(len(states), -1)
+
+    week['count'].fill(0)
+    week['types'].fill(False)
+    week['frequency'].fill(0)
+    count('weekly_transitions', len(states))
+
+
+# Update state
+@instrumented
+def update_state(state, week, Date, state_variables, truck_types, plan=None):
+    """
+    Take the current state and the running tallies of the week's actions (see new_week) and return
+    the state on the given Date (emitting the weekly variables and clearing the tallies as necessary)
+    """
+
+    # Copy so that I don't accidently change the previous state
+    if plan is None:
+        plan = make_simulation_plan(state_variables, truck_types)
+    Date = pd.Timestamp(Date)
+    new_state = encode_state(state)[np.newaxis, :]
+
+    # If its the first day of the week, write the state variables based on
+    # the actions from the previous week and reset the tallies
+    if Date.dayofweek == 0:
+        end_week(new_state, week, plan)
+
+    # Update the day of week and quarter
+    new_state[0, plan['quarter']] = Date.quarter
+    new_state[0, plan['day_of_week']] = Date.dayofweek
+
+    return [new_state[0], week]
+
+
+# Simulate a single path
+@instrumented
+def simulate_single_path(probabilities, starting_state, starting_date, periods, discount, state_variables, truck_id, action_generator, specific_action, truck_types, numeric=False):
+    """
+    Simulate a single path of actions for a truck and return the value function experienced
+    (as a trucks by parameters matrix of coefficients when numeric is set)
+    """
+
+    # Set the initial values
+    current_date = dt.datetime.strptime(starting_date, '%Y-%m-%d')
+    current_state = encode_state(starting_state)
+    T = 0
+    if numeric:
+        pdv_profits = np.zeros((len(truck_types), NUM_PARAMETERS + 1))
+    else:
+        pdv_profits = np.zeros(len(truck_types))
+    plan = make_simulation_plan(state_variables, truck_types)
+    week = new_week(1, plan)
+
+    while T < periods:
+        # Find the optimal actions
+        actions = optimal_action(
+            probabilities, current_state, truck_types, state_variables)
+
+        # Replace specific truck's action with alternate strategy if requested
+        if action_generator == 'Random':
+            truck_actions = generate_random_actions(truck_types)
+            truck_actions = truck_actions[truck_actions.Truck == truck_id]
+            actions = actions[actions.Truck != truck_id]
+            actions = actions.append(truck_actions)
+
+        if action_generator == 'Specific':
+            truck_actions = generate_certain_actions(
+                specific_action, truck_types)
+            truck_actions = truck_actions[truck_actions.Truck == truck_id]
+            actions = actions[actions.Truck != truck_id]
+            actions = actions.append(truck_actions)
+
+        # Create the profit vector and add to the discounted sum of profits
+        if numeric:
+            pdv_profits += discount ** T * create_profit_matrix(state_variables=state_variables,
+                                                                state=current_state,
+                                                                actions=actions,
+                                                                truck_types=truck_types)
+        else:
+            period_profits = create_profit_vector(state_variables=state_variables,
+                                                  state=current_state,
+                                                  actions=actions,
+                                                  truck_types=truck_types)
+            pdv_profits += discount ** T * period_profits.Profit
+
+        # Add current actions to the week's tallies
+        chosen = dict(zip(actions.Truck, actions.Location))
+        choices = np.array([[action_index[chosen[truck]] for truck in plan['trucks']]])
+        accumulate_week(week, np.eye(len(action_locations))[choices], plan)
+
+        # Update counters
+        T += 1
+        current_date += dt.timedelta(days=1)
+
+        # Update state for the next day
+        (current_state, week) = update_state(state=current_state,
+                                             week=week,
+                                             Date=current_date,
+                                             state_variables=state_variables,
+                                             truck_types=truck_types,
+                                             plan=plan)
+
+    count('paths_completed')
+    count('path_days', periods)
+
+    if numeric:
+        return pdv_profits
+
+    return pd.DataFrame([period_profits.Truck, pdv_profits]).transpose()
+
+
+# Lay the compiled policy out as sorted arrays for the batched simulation
+def compile_policy_table(probabilities, truck_types):
+    """
+    Returns a dictionary with a sorted array of (truck, sub-state) keys and the matching rows of
+    log probabilities over action_locations (the final row is the fallback of acting randomly)
+    """
+
+    # Already compiled
+    if isinstance(probabilities, dict) and 'log_probabilities' in probabilities:
+        return probabilities
+
+    # Key each entry by the truck's position in truck_types and the sub-state code
+    policy = compile_policy(probabilities)
+    truck_rows = dict((truck, row) for (row, truck) in enumerate(truck_types.Truck))
+    entries = sorted([(truck_rows[truck] * SUB_STATE_SPAN + code, location_codes, log_probabilities)
+                      for ((truck, code), (location_codes, log_probabilities)) in policy.items()
+                      if truck in truck_rows], key=lambda entry: entry[0])
+
+    # The final key is a sentinel that every lookup can fall back to
+    keys = np.array([entry[0] for entry in entries] + [np.iinfo(np.int64).max],
+                    dtype=np.int64)
+    log_probabilities = np.empty((len(entries) + 1, len(action_locations)))
+    log_probabilities.fill(-np.inf)
+    for (row, entry) in enumerate(entries):
+        log_probabilities[row, entry[1]] = entry[2]
+
+    # The random fallback puts a null prior over the locations (see
+    # generate_random_actions)
+    log_probabilities[-1, :action_index['Other']] = 0
+
+    return {'keys': keys,
+            'offsets': np.arange(len(truck_types), dtype=np.int64) * SUB_STATE_SPAN,
+            'log_probabilities': log_probabilities}
+
+
+# Draw the optimal actions on every path at once
+@instrumented
+def sample_actions(policy_table, states, plan, draws):
+    """
+    Returns paths by trucks arrays of chosen location codes and the shocks of the chosen actions
+    given the paths by trucks by action_locations draws of the shocks
+    """
+
+    # Look up each truck's sub-state on each path (misses land on the fallback)
+    codes = states[:, plan['sub_states']].astype(np.int64).dot(sub_state_multipliers)
+    keys = codes + policy_table['offsets']
+    rows = np.searchsorted(policy_table['keys'], keys)
+    misses = policy_table['keys'][rows] != keys
+    rows[misses] = len(policy_table['keys']) - 1
+    if metrics is not None:
+        count('policy_hits', misses.size - misses.sum())
+        count('random_fallbacks', misses.sum())
+        count_fallbacks(plan['trucks'], keys[misses])
+
+    # Hotz-Miller inversion (the largest log probability plus shock)
+    choices = (policy_table['log_probabilities'][rows] + draws).argmax(axis=2)
+    shocks = draws[np.arange(len(states))[:, np.newaxis],
+                   np.arange(len(plan['trucks'])), choices]
+
+    return [choices, shocks]
+
+
+# Add the discounted period profits on every path at once
+@instrumented
+def add_profits(pdv_profits, weight, states, choices, shocks, actions, plan):
+    """
+    Adds weight times the period profits (as coefficients, see get_profit_coefficients) to pdv_profits
+    """
+
+    paths = np.arange(len(states))[:, np.newaxis]
+    trucks = np.arange(len(plan['trucks']))
+    active = weight * (choices != action_index['Other'])
+    location = np.where(choices != action_index['Other'], choices, 0)
+
+    # Create variables based on current actions and discretize
+    current_count = actions.sum(axis=1)
+    current_unique = (np.dot(actions.transpose(0, 2, 1), plan['types']) > 0).sum(axis=2)
+    current_count = current_count >= HIGH_COUNT
+    current_unique = current_unique >= HIGH_UNIQUE
+
+    # Intercept, day of week, quarter, location, and shock
+    pdv_profits[:, :, parameter_index['intercept']] += active
+    pdv_profits[paths, trucks, day_parameters[
+        states[:, plan['day_of_week']]][:, np.newaxis]] += active
+    pdv_profits[paths, trucks, quarter_parameters[
+        states[:, plan['quarter']] - 1][:, np.newaxis]] += active
+    pdv_profits[:, :, location_parameters] += weight * \
+        actions[:, :, :len(location_parameters)]
+    pdv_profits[:, :, SHOCK] += active * shocks
+
+    # Historic count, diversity, and truck frequency at chosen location
+    pdv_profits[:, :, parameter_index['high_historic_count']] += active * \
+        states[paths, plan['count'][location]]
+    pdv_profits[:, :, parameter_index['high_historic_diversity']] += active * \
+        states[paths, plan['unique'][location]]
+    pdv_profits[:, :, parameter_index['high_historic_freq']] += active * \
+        states[paths, plan['frequency'][trucks, location]]
+
+    # Current location variables
+    pdv_profits[:, :, parameter_index['high_current_count']] += active * \
+        current_count[paths, choices]
+    pdv_profits[:, :, parameter_index['high_current_diversity']] += active * \
+        current_unique[paths, choices]
+
+
+# Simulate N paths in lockstep
+def simulate_paths(policy_table, starting_state, starting_date, periods, discount, state_variables, truck_id, action_generator, specific_action, N, truck_types, random_state=None):
+    """
+    Simulate N paths of actions for all trucks at once and return the value functions experienced
+    as a paths by trucks by parameters array of coefficients. Every strategy consumes exactly one
+    draw of shocks per day from random_state, so runs started from the same seed share their shocks
+    """
+
+    return simulate_strategies(policy_table=policy_table,
+                               starting_state=starting_state,
+                               starting_date=starting_date,
+                               periods=periods,
+                               discount=discount,
+                               state_variables=state_variables,
+                               strategies=[(truck_id, action_generator, specific_action)],
+                               N=N,
+                               truck_types=truck_types,
+                               random_state=random_state)[0]
+
+
+# Simulate N paths in lockstep for several strategies at once
+@instrumented
+def simulate_strategies(policy_table, starting_state, starting_date, periods, discount, state_variables, strategies, N, truck_types, random_state=None):
+    """
+    Simulate N paths of actions for all trucks under each of the (truck_id, action_generator,
+    specific_action) strategies and return a strategies by paths by trucks by parameters array of
+    coefficients. The strategies branch off the same draws of the shocks on every path
+    """
+
+    # Set the initial values (the strategies are stacked along the paths)
+    if random_state is None:
+        random_state = np.random
+    policy_table = compile_policy_table(policy_table, truck_types)
+    plan = make_simulation_plan(state_variables, truck_types)
+    current_date = dt.datetime.strptime(starting_date, '%Y-%m-%d')
+    branches = len(strategies)
+    states = np.tile(encode_state(starting_state), (branches * N, 1))
+    week = new_week(branches * N, plan)
+    pdv_profits = np.zeros((branches * N, len(plan['trucks']), NUM_PARAMETERS + 1))
+    deviations = [(slice(branch * N, (branch + 1) * N), plan['trucks'].index(truck_id),
+                   action_generator, specific_action)
+                  for (branch, (truck_id, action_generator, specific_action)) in enumerate(strategies)
+                  if action_generator in ['Random', 'Specific']]
+
+    for T in xrange(periods):
+
+        # The starting state holds on the first day. Afterwards the weekly
+        # variables are built from the previous calendar week (the same lag
+        # that make_states uses for the probabilities) and the day of week
+        # and quarter follow the date
+        if T > 0:
+            if current_date.weekday() == 0:
+                end_week(states, week, plan)
+            states[:, plan['quarter']] = (current_date.month - 1) // 3 + 1
+            states[:, plan['day_of_week']] = current_date.weekday()
+
+        # Find the optimal actions (every branch sees the same shocks)
+        draws = random_state.gumbel(
+            loc=0.0, scale=1.0, size=(N, len(plan['trucks']), len(action_locations)))
+        draws = np.tile(draws, (branches, 1, 1))
+        (choices, shocks) = sample_actions(policy_table, states, plan, draws)
+
+        # Replace specific truck's action with alternate strategy if requested
+        # (reusing the truck's own draws of the shocks)
+        for (paths, deviator, action_generator, specific_action) in deviations:
+            if action_generator == 'Random':
+                own_draws = draws[paths, deviator, :len(location_names)]
+                choices[paths, deviator] = own_draws.argmax(axis=1)
+                shocks[paths, deviator] = own_draws.max(axis=1)
+
+            if action_generator == 'Specific':
+                choices[paths, deviator] = action_index[specific_action]
+                shocks[paths, deviator] = draws[
+                    paths, deviator, action_index[specific_action]]
+
+        # Add to the discounted sum of profits and to the week's tallies
+        actions = np.eye(len(action_locations))[choices]
+        add_profits(pdv_profits, discount ** T, states,
+                    choices, shocks, actions, plan)
+        accumulate_week(week, actions, plan)
+
+        # Update counters
+        current_date += dt.timedelta(days=1)
+
+    count('paths_completed', branches * N)
+    count('path_days', branches * N * periods)
+
+    return pdv_profits.reshape((branches, N) + pdv_profits.shape[1:])
+
+
+# Average over N simulations of the valuation function
+def find_value_function(probabilities, starting_state, starting_date, periods, discount, state_variables, truck_id, action_generator, specific_action, N, truck_types, numeric=False, seed=None):
+    """
+    Average over N simulations of the valuation function for the truck (or a dictionary of the
+    value functions of all trucks when truck_id is None). Numeric simulations can be seeded so that
+    different strategies see the same shocks
+    """
+
+    # Numeric mode simulates the N paths in lockstep and returns the truck's
+    # averaged coefficients
+    if numeric:
+        value_functions = simulate_paths(policy_table=probabilities,
+                                         starting_state=starting_state,
+                                         starting_date=starting_date,
+                                         periods=periods,
+                                         discount=discount,
+                                         state_variables=state_variables,
+                                         truck_id=truck_id,
+                                         action_generator=action_generator,
+                                         specific_action=specific_action,
+                                         N=N,
+                                         truck_types=truck_types,
+                                         random_state=np.random.RandomState(seed)
+                                         if seed is not None else None).mean(axis=0)
+
+        if truck_id is None:
+            return dict(zip(truck_types.Truck, value_functions))
+
+        return value_functions[list(truck_types.Truck).index(truck_id)]
+
+    # Index the probabilities once for all of the paths
+    probabilities = compile_policy(probabilities)
+
+    # Set initial values
+    value_functions = np.zeros(len(truck_types))
+
+    # Run N times
+    for x in xrange(N):
+        Results = simulate_single_path(probabilities=probabilities,
+                                       starting_state=starting_state,
+                                       starting_date=starting_date,
+                                       periods=periods,
+                                       discount=discount,
+                                       state_variables=state_variables,
+                                       truck_id=truck_id,
+                                       action_generator=action_generator,
+                                       specific_action=specific_action,
+                                       truck_types=truck_types)
+
+        value_functions += 1. / N * Results.Profit
+
+    # Format results
+    Step_One = pd.DataFrame([Results.Truck, value_functions]).transpose()
+    if truck_id is None:
+        return dict(zip(Step_One.Truck, Step_One.Profit))
+
+    return Step_One[Step_One.Truck == truck_id].Profit.get_values()[0]
+
+
+# Identify an inequality across runs
+def checkpoint_key(row):
+    """
+    Returns a hashable key for the inequality (truck, strategy, and starting state) of a row or record
+    """
+
+    return (row['Truck'], row['action_generator'], row['specific_action'],
+            tuple(int(x) for x in row['State']))
+
+
+# Fingerprint a compiled policy
+def policy_hash(policy, block_size=2 ** 16):
+    """
+    Returns the sha1 hex digest of a policy table (see compile_policy_table, hashed block_size rows
+    at a time) or of a policy compiled by compile_policy()
+    """
+
+    digest = hashlib.sha1()
+    if 'log_probabilities' in policy:
+        for name in ['keys', 'log_probabilities']:
+            for start in xrange(0, len(policy[name]), block_size):
+                digest.update(np.ascontiguousarray(policy[name][start:start + block_size]).tostring())
+    else:
+        for key in sorted(policy):
+            digest.update(repr(key))
+            for array in policy[key]:
+                digest.update(np.ascontiguousarray(array).tostring())
+
+    return digest.hexdigest()
+
+
+# Append a finished inequality (or the header) to the checkpoint file
+def write_checkpoint(checkpoint, record):
+    """
+    Appends the record (truck, strategy, state, seed, value functions, and g) to the checkpoint file.
+    The first record of a file is its header (the settings of the run and the inequalities drawn)
+    """
+
+    with open(checkpoint, 'ab') as f:
+        pickle.dump(record, f, pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# Read the finished inequalities from a checkpoint file
+def read_checkpoint(checkpoint, truncate=False):
+    """
+    Returns the header of the checkpoint file (None if there is none yet) and the list of its
+    records (ignoring a record cut off by a crash, which is also removed from the file when
+    truncate is set so that new records can be appended)
+    """
+
+    records = []
+    if not os.path.exists(checkpoint):
+        return [None, records]
+
+    with open(checkpoint, 'rb') as f:
+        end = 0
+        while True:
+            try:
+                records.append(pickle.load(f))
+                end = f.tell()
+            except (EOFError, pickle.UnpicklingError, ValueError, IndexError):
+                break
+
+    if truncate and end < os.path.getsize(checkpoint):
+        with open(checkpoint, 'r+b') as f:
+            f.truncate(end)
+
+    if not records:
+        return [None, records]
+    if 'settings' not in records[0]:
+        raise ValueError('checkpoint ' + checkpoint + ' has no header (remove it to start over)')
+
+    return [records[0], records[1:]]
+
+
+# Read the g terms of the finished inequalities in a checkpoint file
+def checkpoint_g(checkpoint):
+    """
+    Returns the g terms of the records in the checkpoint file as an array laid out as by save_g()
+    """
+
+    (header, records) = read_checkpoint(checkpoint)
+    (G, c) = compile_g(pd.DataFrame({'g': [record['g'] for record in records]}))
+
+    return np.column_stack([G, c])
+
+
+# Average over N simulations of the valuation functions of several strategies
+def find_value_functions(probabilities, starting_state, starting_date, periods, discount, state_variables, strategies, N, truck_types, seed=None):
+    """
+    Average over N simulations (shared by all of the strategies) of the valuation function of each
+    (truck_id, action_generator, specific_action) strategy's truck and return them as a list
+    """
+
+    value_functions = simulate_strategies(policy_table=probabilities,
+                                          starting_state=starting_state,
+                                          starting_date=starting_date,
+                                          periods=periods,
+                                          discount=discount,
+                                          state_variables=state_variables,
+                                          strategies=strategies,
+                                          N=N,
+                                          truck_types=truck_types,
+                                          random_state=np.random.RandomState(seed)
+                                          if seed is not None else None).mean(axis=1)
+    trucks = list(truck_types.Truck)
+
+    return [value_functions[branch, trucks.index(strategy[0])]
+            for (branch, strategy) in enumerate(strategies)]
+
+
+# Make the policy table available to worker processes without copying it
+def share_policy_table(policy_table):
+    """
+    Returns the names of memory-mapped files holding the policy table's arrays (the table's own
+    files if it was loaded from a bundle, else new files in a temporary directory) and the
+    temporary directory (None if there is none to remove)
+    """
+
+    # Reuse the files of a table that is already memory-mapped
+    files = {}
+    for name in ['keys', 'log_probabilities']:
+        array = policy_table[name]
+        if isinstance(array, np.memmap) and array.filename is not None and \
+                np.load(array.filename, mmap_mode='r').shape == array.shape:
+            files[name] = array.filename
+    if len(files) == 2:
+        return [files, None]
+
+    directory = tempfile.mkdtemp(prefix='BBL-')
+    for name in ['keys', 'log_probabilities']:
+        files[name] = os.path.join(directory, name + '.npy')
+        np.save(files[name], policy_table[name])
+
+    return [files, directory]
+
+
+# Attach to a policy table shared by share_policy_table
+def attach_policy_table(files, num_trucks):
+    """
+    Returns the policy table with its arrays memory-mapped read-only from files
+    """
+
+    return {'keys': np.load(files['keys'], mmap_mode='r'),
+            'offsets': np.arange(num_trucks, dtype=np.int64) * SUB_STATE_SPAN,
+            'log_probabilities': np.load(files['log_probabilities'], mmap_mode='r')}
+
+
+# Set up a build_g worker process
+def initialize_worker(inputs, thresholds, instrument=False):
+    """
+    Store the simulation inputs shared by all tasks and the discretization thresholds of the parent
+    process (instrument records metrics for each task, see find_value_function_task)
+    """
+
+    global HIGH_COUNT
+    global HIGH_UNIQUE
+    global HIGH_FREQ
+    (HIGH_COUNT, HIGH_UNIQUE, HIGH_FREQ) = thresholds
+    worker_inputs.update(inputs)
+
+    # Attach to a shared policy table (see share_policy_table)
+    if 'policy_files' in inputs:
+        worker_inputs['probabilities'] = attach_policy_table(
+            worker_inputs.pop('policy_files'), len(inputs['truck_types']))
+
+    if instrument:
+        enable_instrumentation()
+
+
+# Run one chunk of simulations for build_g
+def run_task(inputs, task):
+    """
+    Calls find_value_function (or find_value_functions for tasks with strategies) with the
+    task's arguments and the simulation inputs
+    """
+
+    if 'strategies' in task:
+        return find_value_functions(**dict(inputs, **task))
+
+    # The symbolic simulation draws from the global random state
+    if not task['numeric'] and task['seed'] is not None:
+        np.random.seed(task['seed'])
+
+    return find_value_function(**dict(inputs, **task))
+
+
+def find_value_function_task(task):
+    """
+    Runs the task in a build_g worker process with the worker's simulation inputs and returns its
+    value and the metrics it recorded (None unless instrumented)
+    """
+
+    if metrics is None:
+        return [run_task(worker_inputs, task), None]
+
+    enable_instrumentation()
+    value = run_task(worker_inputs, task)
+    return [value, metrics]
+
+
+# Build the terms that go into the objective to the maximization problem
+def build_g(states, probabilities, periods, discount, state_variables, N, truck_types, num_draws, numeric=False, common_random_numbers=False, processes=None, paths_per_task=None, checkpoint=None, fan_out=False):
+    """
+    Randomly choose num_draws of inequalities to use and estimate the relevant value functions
+    (numeric builds the value functions and g as coefficient vectors, see to_expression(), and
+    common_random_numbers drives both value functions of an inequality with the same shocks).
+    Inequalities that share a starting state and date share a baseline (the simulation of every
+    truck acting optimally), which draws one seed. The baseline and the alternative strategies
+    simulate on streams of that seed (the strategies share the baseline's stream under common
+    random numbers) and each chunk of at most paths_per_task paths is seeded by [seed, stream,
+    chunk], so g does not depend on how processes spreads the chunks over a pool of worker
+    processes. checkpoint names a file that starts with the settings and the inequalities drawn
+    and that each finished inequality is appended to. A rerun with the same settings simulates the
+    inequalities drawn and skips the finished ones (one with other settings raises a ValueError).
+    fan_out evaluates all of a truck's alternative strategies in one simulation per starting state
+    """
+
+    if common_random_numbers and not numeric:
+        raise ValueError('common random numbers require the numeric simulation')
+    if fan_out and not numeric:
+        raise ValueError('fanning out the strategies requires the numeric simulation')
+
+    # Index the probabilities once for all of the simulations
+    if numeric:
+        probabilities = compile_policy_table(probabilities, truck_types)
+    else:
+        probabilities = compile_policy(probabilities)
+
+    # The settings that the value functions depend on. A checkpoint written
+    # with other settings cannot be resumed
+    if paths_per_task is None:
+        paths_per_task = N
+    settings = {'periods': periods,
+                'discount': discount,
+                'N': N,
+                'num_draws': num_draws,
+                'numeric': numeric,
+                'common_random_numbers': common_random_numbers,
+                'paths_per_task': paths_per_task,
+                'fan_out': fan_out,
+                'thresholds': [float(HIGH_COUNT), float(HIGH_UNIQUE), float(HIGH_FREQ)],
+                'state_variables': list(state_variables),
+                'trucks': list(truck_types.Truck),
+                'policy': policy_hash(probabilities)}
+
+    # Pick up the inequalities drawn (and those finished) by an earlier run
+    header = None
+    finished = {}
+    if checkpoint is not None:
+        (header, records) = read_checkpoint(checkpoint, truncate=True)
+        if header is not None and header['settings'] != settings:
+            raise ValueError('checkpoint ' + checkpoint + ' was written with other settings (' +
+                             ', '.join(sorted(name for name in settings
+                                              if header['settings'].get(name) != settings[name])) +
+                             '), remove it to start over')
+        for record in records:
+            finished[checkpoint_key(record)] = record
+
+    columns = ['Truck', 'action_generator', 'specific_action', 'State', 'starting_date', 'seed']
+    if header is not None:
+        container_table = pd.DataFrame(header['inequalities'], columns=columns)
+        container_table['State'] = pd.Series(
+            [encode_state(state) for state in container_table.State], index=container_table.index)
+
+    else:
+        # Create columns with truck
+        container_table = truck_types.drop('Type', axis=1)
+
+        # Interact trucks with alternative strategies being considered
+        temp1 = pd.DataFrame(['Random'], columns=['action_generator'])
+        temp2 = pd.DataFrame(list(location_names), columns=['specific_action'])
+        temp2['action_generator'] = 'Specific'
+        temp2 = temp2.append(temp1)
+        container_table['key'] = 1
+        temp2['key'] = 1
+        container_table = pd.merge(container_table, temp2, on='key').ix[
+            :, ('Truck', 'action_generator', 'specific_action')]
+        container_table = container_table.fillna('')
+
+        # Interact trucks and alternative strategies with all possible starting states
+        # being given positive weight
+        container_table['key'] = 1
+        states['key'] = 1
+        container_table = pd.merge(
+            container_table, states, on='key').drop('key', axis=1)
+
+        # Randomly draw requested number of inequalities
+        # Cannot use the .sample() method because only have Pandas 0.15.2 on grid
+        container_table = container_table.reindex(
+            np.random.permutation(container_table.index))
+        container_table = container_table.head(num_draws)
+        container_table['State'] = pd.Series(
+            [encode_state(state) for state in container_table.State], index=container_table.index)
+
+        # Create starting date appropriate for quarter
+        # by randomly drawing from the possibilities
+        # Currently NOT WORKING! Has everything starting on first day of quarter.
+        dates = pd.date_range(start='1/1/2011', end='12/31/2011', freq='D')
+        container_table['starting_date'] = container_table.State.apply(
+            lambda row: pd.DataFrame(dates[(dates.quarter == row[state_variables.index('Quarter')])
+                ]).head(1)[0].apply(str).values[0][:10])
+
+    # Inequalities that share a starting state and date share the simulation
+    # of every truck acting optimally (the baseline)
+    # (members holds the positions of each baseline's inequalities, in the
+    # order the baselines are first drawn)
+    baselines = [(tuple(int(x) for x in row['State']), row['starting_date'])
+                 for (index, row) in container_table.iterrows()]
+    members = collections.OrderedDict()
+    for (position, key) in enumerate(baselines):
+        members.setdefault(key, []).append(position)
+    baseline_keys = list(members)
+
+    # Draw a seed for each baseline's shocks (whether or not there is a pool,
+    # so that g does not depend on processes) and record the settings and
+    # the inequalities drawn before any results so that a resumed run
+    # simulates the same inequalities
+    if header is None:
+        seeds = dict(zip(baseline_keys, np.random.randint(
+            0, 2 ** 31 - 1, size=len(baseline_keys))))
+        container_table['seed'] = [seeds[key] for key in baselines]
+        if checkpoint is not None:
+            write_checkpoint(checkpoint, {
+                'settings': settings,
+                'inequalities': [dict(zip(columns, [row['Truck'], row['action_generator'],
+                                                    row['specific_action'],
+                                                    tuple(int(x) for x in row['State']),
+                                                    row['starting_date'], int(row['seed'])]))
+                                 for (index, row) in container_table.iterrows()]})
+
+    # The alternative strategies of a baseline's inequalities get streams of
+    # their own (or share the baseline's stream under common random numbers)
+    streams = []
+    drawn = collections.Counter()
+    for key in baselines:
+        drawn[key] += 1
+        streams.append(0 if common_random_numbers else drawn[key])
+
+    # Group the unfinished inequalities by baseline
+    rows = [row for (index, row) in container_table.iterrows()]
+    keys = [checkpoint_key(row) for row in rows]
+    groups = [(key, [position for position in members[key] if keys[position] not in finished])
+              for key in baseline_keys]
+    groups = [(key, positions) for (key, positions) in groups if positions]
+
+    # Lay out the simulations, each split into chunks of paths. Chunk seeds
+    # are [baseline seed, stream, chunk] so that the results do not depend
+    # on how the chunks are scheduled
+    chunks = [min(paths_per_task, N - start) for start in xrange(0, N, paths_per_task)]
+
+    def chunk_tasks(row, truck_id, action_generator, specific_action, stream):
+        return [{'starting_state': row['State'],
+                 'starting_date': row['starting_date'],
+                 'truck_id': truck_id,
+                 'action_generator': action_generator,
+                 'specific_action': specific_action,
+                 'N': size,
+                 'numeric': numeric,
+                 'seed': [int(row['seed']), stream, chunk]}
+                for (chunk, size) in enumerate(chunks)]
+
+    # When fanning out, each truck's alternative strategies branch off one
+    # set of paths with a stream per truck (numbered over all of the
+    # baseline's trucks so that a resumed run keeps them). Returns the trucks
+    # with unfinished strategies, in the order of their tasks, and the tasks
+    def fan_out_tasks(key, positions):
+        strategies = collections.OrderedDict()
+        for position in members[key]:
+            strategies.setdefault(rows[position]['Truck'], [])
+        for position in positions:
+            strategies[rows[position]['Truck']].append(
+                (rows[position]['Truck'], rows[position]['action_generator'],
+                 rows[position]['specific_action']))
+        trucks = []
+        tasks = []
+        for (stream, truck) in enumerate(strategies):
+            if strategies[truck]:
+                trucks.append(truck)
+                for task in chunk_tasks(rows[positions[0]], truck, '', '',
+                                        0 if common_random_numbers else stream + 1):
+                    tasks.append({'starting_state': task['starting_state'],
+                                  'starting_date': task['starting_date'],
+                                  'strategies': strategies[truck],
+                                  'N': task['N'],
+                                  'seed': task['seed']})
+        return [trucks, tasks]
+
+    tasks = []
+    fanned_trucks = {}
+    for (key, positions) in groups:
+        tasks += chunk_tasks(rows[positions[0]], None, 'Optimal', '', 0)
+        if fan_out:
+            (fanned_trucks[key], fanned_tasks) = fan_out_tasks(key, positions)
+            tasks += fanned_tasks
+        else:
+            for position in positions:
+                row = rows[position]
+                tasks += chunk_tasks(row, row['Truck'], row['action_generator'],
+                                     row['specific_action'], streams[position])
+
+    # Average the chunks (baselines hold the value functions of all trucks
+    # and fanned out tasks a list with one per strategy)
+    def combine(results):
+        if len(results) == 1:
+            return results[0]
+        if isinstance(results[0], dict):
+            return dict((truck, combine([result[truck] for result in results]))
+                        for truck in results[0])
+        if isinstance(results[0], list):
+            return [combine([result[branch] for result in results])
+                    for branch in xrange(len(results[0]))]
+        return sum(size * value for (size, value) in zip(chunks, results)) / float(N)
+
+    # Estimate the value functions (lazily, so that each inequality can be
+    # stored as soon as its chunks are done)
+    inputs = {'probabilities': probabilities,
+              'periods': periods,
+              'discount': discount,
+              'state_variables': state_variables,
+              'truck_types': truck_types}
+    pool = None
+    shared = None
+    try:
+        if processes is None:
+            values = (run_task(inputs, task) for task in tasks)
+        else:
+            # Workers attach to one memory-mapped copy of the policy table
+            # rather than each receiving their own
+            pool_inputs = inputs
+            if numeric:
+                (policy_files, shared) = share_policy_table(probabilities)
+                pool_inputs = dict(inputs, policy_files=policy_files)
+                del pool_inputs['probabilities']
+            pool = mp.Pool(processes, initializer=initialize_worker,
+                           initargs=(pool_inputs, [HIGH_COUNT, HIGH_UNIQUE, HIGH_FREQ],
+                                     metrics is not None))
+            values = pool.imap(find_value_function_task, tasks)
+
+            # Collect the metrics recorded by the workers
+            def unpack(results):
+                for (value, recorded) in results:
+                    merge_metrics(recorded)
+                    yield value
+            values = unpack(values)
+
+        for (key, positions) in groups:
+            baseline = combine([next(values) for size in chunks])
+            if fan_out:
+                fanned_out = {}
+                for truck in fanned_trucks[key]:
+                    fanned_out[truck] = combine([next(values) for size in chunks])
+            for position in positions:
+                record = rows[position][['Truck', 'action_generator', 'specific_action',
+                                         'State', 'starting_date', 'seed']].to_dict()
+                if fan_out:
+                    record['Value_Function_For_Other_Actions'] = fanned_out[record['Truck']].pop(0)
+                else:
+                    record['Value_Function_For_Other_Actions'] = combine(
+                        [next(values) for size in chunks])
+                record['Value_Function'] = baseline[record['Truck']]
+                record['g'] = record['Value_Function'] - \
+                    record['Value_Function_For_Other_Actions']
+                finished[keys[position]] = record
+                if checkpoint is not None:
+                    write_checkpoint(checkpoint, record)
+
+        if pool is not None:
+            pool.close()
+
+    # Stop the workers rather than leaving them running
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+
+    # Remove the shared copy of the policy table however the run ends
+    finally:
+        if pool is not None:
+            pool.join()
+        if shared is not None:
+            shutil.rmtree(shared)
+
+    # Collect the value functions (kept as lists rather than going through
+    # apply() so that numeric value functions stay arrays)
+    records = [finished[key] for key in keys]
+    container_table['seed'] = [record['seed'] for record in records]
+    container_table['Value_Function_For_Other_Actions'] = pd.Series(
+        [record['Value_Function_For_Other_Actions'] for record in records],
+        index=container_table.index)
+    container_table['Value_Function'] = pd.Series(
+        [record['Value_Function'] for record in records], index=container_table.index)
+
+    # Form the relevant differences
+    container_table['g'] = container_table.Value_Function - \
+        container_table.Value_Function_For_Other_Actions
+
+    return container_table
+
+
+# Compile the g terms into a matrix of coefficients on the parameters
+def compile_g(g):
+    """
+    Returns the matrix G and vector c such that the g terms equal G * theta + c
+    (g is a table of estimated inequalities or an array of g terms as stored by save_g())
+    """
+
+    # Stored g terms are already G and c side by side
+    if isinstance(g, np.ndarray):
+        return [g[:, :NUM_PARAMETERS], g[:, SHOCK]]
+
+    G = np.zeros((len(g), NUM_PARAMETERS))
+    c = np.zeros(len(g))
+    for (row, term) in enumerate(g.g):
+
+        # Numeric g terms are already coefficient vectors
+        if isinstance(term, np.ndarray):
+            G[row] = term[:NUM_PARAMETERS]
+            c[row] = term[SHOCK]
+
+        # Else read the coefficients off the (linear) sympy expression
+        else:
+            import sympy as sp
+            for (atom, coefficient) in sp.sympify(term).as_coefficients_dict().items():
+                if atom == 1:
+                    c[row] += float(coefficient)
+                elif isinstance(atom, sp.Symbol) and str(atom) in parameter_index:
+                    G[row, parameter_index[str(atom)]] += float(coefficient)
+                else:
+                    raise ValueError('g term is not linear in the parameters: ' + str(term))
+
+    return [G, c]
+
+
+# Find an array file of a store directory
+def store_file(path, name, generation):
+    """
+    Returns the path of the .npy file of the array name of the given generation in the directory path
+    """
+
+    return os.path.join(path, name + '-' + str(generation) + '.npy')
+
+
+# Write a directory of arrays and their manifest
+def save_store(path, arrays, manifest):
+    """
+    Write the arrays (a dictionary of names and arrays) to the directory path as .npy files of a new
+    generation, then replace the manifest with one naming that generation and remove the files of the
+    old one. A crash at any point leaves the manifest and the files it names as they were
+    """
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    manifest_path = os.path.join(path, 'manifest.json')
+    previous = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            previous = json.load(f).get('generation')
+    generation = 0 if previous is None else previous + 1
+
+    for (name, array) in arrays.items():
+        np.save(store_file(path, name, generation), array)
+
+    # The manifest is replaced last (in one rename) so that it only ever names
+    # complete files
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(dict(manifest, generation=generation), f, encoding='latin-1')
+    os.rename(manifest_path + '.tmp', manifest_path)
+
+    if previous is not None:
+        for name in arrays:
+            if os.path.exists(store_file(path, name, previous)):
+                os.remove(store_file(path, name, previous))
+
+
+# Store the inputs of the simulations as an artifact bundle
+def save_bundle(path, states, probabilities, state_variables, truck_types):
+    """
+    Write the states (as a matrix of small integers), the compiled policy table, the state
+    variables, trucks, locations and discretization thresholds to the directory path (replacing
+    a bundle there whole, see save_store)
+    """
+
+    policy_table = compile_policy_table(probabilities, truck_types)
+    save_store(path,
+               {'states': np.array([encode_state(state) for state in states], dtype=np.int8),
+                'policy_keys': policy_table['keys'],
+                'policy_log_probabilities': policy_table['log_probabilities']},
+               {'version': BUNDLE_VERSION,
+                'state_variables': list(state_variables),
+                'trucks': list(truck_types.Truck),
+                'types': list(truck_types.Type),
+                'locations': action_locations,
+                'thresholds': [float(HIGH_COUNT), float(HIGH_UNIQUE), float(HIGH_FREQ)]})
+
+
+# Read an artifact bundle
+def load_bundle(path, mmap=True):
+    """
+    Returns a dictionary with the states, policy table, state variables and truck types stored by
+    save_bundle() and sets the discretization thresholds. The arrays are memory-mapped unless mmap
+    is False
+    """
+
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    if manifest['version'] != BUNDLE_VERSION:
+        raise ValueError('bundle ' + path + ' has version ' + str(manifest['version']) +
+                         ', expected ' + str(BUNDLE_VERSION))
+    if manifest['locations'] != action_locations:
+        raise ValueError('bundle ' + path + ' was built for other locations')
+
+    # Names come back from json as unicode
+    def names(values):
+        return [value.encode('latin-1') for value in values]
+
+    global HIGH_COUNT
+    global HIGH_UNIQUE
+    global HIGH_FREQ
+    (HIGH_COUNT, HIGH_UNIQUE, HIGH_FREQ) = manifest['thresholds']
+
+    mmap_mode = 'r' if mmap else None
+    generation = manifest['generation']
+    states = np.load(store_file(path, 'states', generation), mmap_mode=mmap_mode)
+    truck_types = pd.DataFrame({'Truck': names(manifest['trucks']),
+                                'Type': names(manifest['types'])})[['Truck', 'Type']]
+
+    return {'states': pd.DataFrame({'State': list(states)}),
+            'probabilities': {'keys': np.load(store_file(path, 'policy_keys', generation),
+                                              mmap_mode=mmap_mode),
+                              'offsets': np.arange(len(truck_types), dtype=np.int64) * SUB_STATE_SPAN,
+                              'log_probabilities': np.load(
+                                  store_file(path, 'policy_log_probabilities', generation),
+                                  mmap_mode=mmap_mode)},
+            'state_variables': names(manifest['state_variables']),
+            'truck_types': truck_types}
+
+
+# Store the g terms
+def save_g(path, g):
+    """
+    Write the g terms as a .npy file with a row per inequality and a column per parameter
+    (in the order of parameter_names) followed by the constant
+    """
+
+    (G, c) = compile_g(g)
+    np.save(path, np.column_stack([G, c]))
+
+
+# Read stored g terms
+def load_g(paths, mmap=True):
+    """
+    Read the g terms written by save_g() to one or more files. A single file is memory-mapped
+    (unless mmap is False) rather than read
+    """
+
+    if isinstance(paths, basestring):
+        paths = [paths]
+
+    g = [np.load(path, mmap_mode='r' if mmap else None) for path in paths]
+    for (path, terms) in zip(paths, g):
+        if terms.ndim != 2 or terms.shape[1] != NUM_PARAMETERS + 1:
+            raise ValueError('g terms in ' + path + ' do not have a column per parameter and the constant')
+
+    if len(g) == 1:
+        return g[0]
+    return np.concatenate(g)
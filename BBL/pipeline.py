@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+"""
+pipeline.py: Builds the datasets of createdata.py as a chain of stages
+with explicit parameters, caching the output of each stage on disk under a
+hash of its inputs and parameters so that only the stages downstream of a
+change are rerun
+"""
+
+__author__ = 'Eliot Abrams'
+__copyright__ = "Copyright (C) 2015 Eliot Abrams"
+__license__ = "MIT"
+__version__ = "1.0.0"
+__email__ = "eabrams@uchicago.edu"
+__status__ = "Production"
+
+
+# Packages
+import pandas as pd
+import numpy as np
+import cPickle as pickle
+import hashlib
+import json
+import os
+import BBL.kernel as kernel
+from BBL.ingest import ingest_locations
+
+# Version of the stages (bump to invalidate the cached outputs when a stage
+# changes)
+PIPELINE_VERSION = 2
+
+
+# Hash the contents of a file
+def file_hash(path, block_size=2 ** 20):
+    """
+    Returns the sha1 hex digest of the file at path (read in blocks of block_size bytes)
+    """
+
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), ''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+# Run a stage or load its output from the cache
+def run_stage(cache, name, inputs, parameters, function):
+    """
+    Returns the key of the stage (a hash of its name, the keys of its inputs and its parameters)
+    and its output, which is read from the cache directory if present and else computed by
+    function and written there (cache None turns the caching off)
+    """
+
+    key = hashlib.sha1(json.dumps([PIPELINE_VERSION, name, inputs, parameters],
+                                  sort_keys=True)).hexdigest()
+    if cache is None:
+        return [key, function()]
+
+    path = os.path.join(cache, name + '-' + key + '.pkl')
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return [key, pickle.load(f)]
+
+    # Write to a temporary file first so that an interrupted run does not
+    # leave a partial output behind
+    output = function()
+    if not os.path.isdir(cache):
+        os.makedirs(cache)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.rename(path + '.tmp', path)
+
+    return [key, output]
+
+
+##############################
+##         Stages           ##
+##############################
+
+# Clean the raw location data
+def clean_parkings(locations, truck_types, first_year=2014, truck_cutoff=66,
+                   excluded_types=['Dessert'], excluded_trucks=['Eastman Egg']):
+    """
+    Returns the lunch time parkings (Location, Truck and Date) of the trucks with more than
+    truck_cutoff weekday parkings from first_year on and the truck types less the excluded types
+    """
+
+    truck_types = truck_types[~truck_types.Type.isin(excluded_types)]
+    location_data = ingest_locations(locations,
+                                     trucks=truck_types.Truck[~truck_types.Truck.isin(excluded_trucks)],
+                                     first_year=first_year, min_parkings=truck_cutoff + 1)
+
+    return [location_data, truck_types]
+
+
+# Drop rare locations
+def drop_rare_locations(location_data, location_cutoff=150):
+    """
+    Keep the parkings at the locations with more than location_cutoff parkings
+    """
+
+    counts = location_data.Location.value_counts()
+    return location_data[location_data.Location.isin(counts.index[counts > location_cutoff])]
+
+
+# Clean the location names
+def normalize_names(names):
+    """
+    Strips the spaces and street numbers from a Series of location names (cleaning each distinct
+    name once)
+    """
+
+    (codes, uniques) = pd.factorize(names)
+    cleaned = pd.Series(np.asarray(uniques, dtype=object))
+    cleaned = cleaned.str.replace(' ', '').str.replace('600', '').str.replace('450N.', '')
+
+    return pd.Series(cleaned.values[codes], index=names.index)
+
+
+# Complete the panel
+def complete_panel(location_data, truck_types, trucks=None):
+    """
+    Returns the panel of Truck, Date, and Location with a row for every truck (those in the parkings
+    by default, else the given ones) and date in the parkings (sorted by Truck and Date, with Other
+    where the truck was not observed) and the truck types of the trucks in the panel
+    """
+
+    if trucks is None:
+        (truck_rows, trucks) = pd.factorize(location_data.Truck, sort=True)
+    else:
+        truck_rows = pd.Index(trucks).get_indexer(location_data.Truck)
+        location_data = location_data[truck_rows >= 0]
+        truck_rows = truck_rows[truck_rows >= 0]
+    (date_rows, dates) = pd.factorize(location_data.Date, sort=True)
+    trucks = np.asarray(trucks, dtype=object)
+    dates = np.asarray(dates, dtype=object)
+
+    locations = np.empty(len(trucks) * len(dates), dtype=object)
+    locations[:] = 'Other'
+    locations[truck_rows * len(dates) + date_rows] = location_data.Location.values
+    panel = pd.DataFrame({'Truck': np.repeat(trucks, len(dates)),
+                          'Date': np.tile(dates, len(trucks)),
+                          'Location': locations},
+                         columns=['Truck', 'Date', 'Location'])
+    truck_types = truck_types[truck_types.Truck.isin(trucks)].reset_index(drop=True)
+
+    return [panel, truck_types]
+
+
+# Build the panel of the model's locations
+def build_panel(location_data, truck_types, location_cutoff=150, trucks=None):
+    """
+    Drops the rare locations, cleans the names and completes the panel (the parkings at the
+    rare locations and those the model does not cover are lumped into Other). See complete_panel()
+    for trucks
+    """
+
+    location_data = drop_rare_locations(location_data, location_cutoff).copy()
+    location_data['Location'] = normalize_names(location_data.Location)
+    location_data = location_data[location_data.Location.isin(kernel.location_names)]
+
+    return complete_panel(location_data, truck_types, trucks)
+
+
+# Create the states and the thresholds they are discretized at
+def build_states(location_data, truck_types, quantile=0.8):
+    """
+    Returns the Truck, Location and Date of the location data, their states (as a matrix of small
+    integers with a column per state variable), the state variables and the HIGH_COUNT,
+    HIGH_UNIQUE and HIGH_FREQ thresholds. The output is compact so that it is cheap to cache (see
+    expand_states)
+    """
+
+    (locations_w_states, state_variables) = kernel.make_states(
+        location_data=location_data, making_probabilities=True, truck_types=truck_types,
+        quantile=quantile)
+    states = locations_w_states.loc[:, state_variables].values.astype(np.int8)
+
+    return [locations_w_states.loc[:, ['Truck', 'Location', 'Date']], states, state_variables,
+            [kernel.HIGH_COUNT, kernel.HIGH_UNIQUE, kernel.HIGH_FREQ]]
+
+
+# Attach the states to the location data
+def expand_states(keys, states):
+    """
+    Returns the Truck, Location and Date of build_states() with the State of each row as a tuple
+    (of floats, as made by make_states)
+    """
+
+    locations_w_states = keys.copy()
+    locations_w_states['State'] = [tuple(state) for state in states.astype(float).tolist()]
+
+    return locations_w_states
+
+
+# Run the stages
+def build_data(locations='locations.csv', truck_types='truck_types.csv', cache='cache',
+               first_year=2014, truck_cutoff=66, excluded_types=['Dessert'],
+               excluded_trucks=['Eastman Egg'], location_cutoff=150, quantile=0.8):
+    """
+    Builds the datasets of createdata.py from the raw location data and truck types at the given
+    paths, caching each stage in the cache directory (keyed by the contents of the files and the
+    parameters of that stage and the ones above it). Sets the kernel's thresholds and returns a
+    dict with the parkings, panel (location_data), truck types, locations_w_states (Truck,
+    Location, Date and State), state_variables and probabilities
+    """
+
+    files = [file_hash(locations), file_hash(truck_types)]
+    (key, (parkings, parking_types)) = run_stage(
+        cache, 'parkings', files,
+        {'first_year': first_year, 'truck_cutoff': truck_cutoff,
+         'excluded_types': list(excluded_types), 'excluded_trucks': list(excluded_trucks)},
+        lambda: clean_parkings(locations, pd.read_csv(truck_types), first_year, truck_cutoff,
+                               excluded_types, excluded_trucks))
+    (key, (location_data, types)) = run_stage(
+        cache, 'panel', key, {'location_cutoff': location_cutoff},
+        lambda: build_panel(parkings, parking_types, location_cutoff))
+    (key, (keys, states, state_variables, thresholds)) = run_stage(
+        cache, 'states', key, {'quantile': quantile},
+        lambda: build_states(location_data, types, quantile))
+    locations_w_states = expand_states(keys, states)
+    (kernel.HIGH_COUNT, kernel.HIGH_UNIQUE, kernel.HIGH_FREQ) = thresholds
+    (key, probabilities) = run_stage(
+        cache, 'probabilities', key, {},
+        lambda: kernel.find_probabilities(locations_w_states=locations_w_states,
+                                          state_variables=state_variables))
+
+    return {'parkings': parkings,
+            'location_data': location_data,
+            'truck_types': types,
+            'locations_w_states': locations_w_states,
+            'state_variables': state_variables,
+            'probabilities': probabilities}
@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+
+"""
+scrape.py: Fetches the Weekly Schedule pages hosted by Chicago Food Truck
+Finder (a bounded number at a time, keeping a local copy of each page),
+parses each page once into columns of parking records and cleans the
+records into the schema of locations.csv
+"""
+
+__author__ = 'Eliot Abrams'
+__copyright__ = "Copyright (C) 2015 Eliot Abrams"
+__license__ = "MIT"
+__version__ = "1.0.0"
+__email__ = "eabrams@uchicago.edu"
+__status__ = "Production"
+
+
+# Packages
+import urllib2
+import Queue
+import threading
+import hashlib
+import json
+import csv
+import os
+import pandas as pd
+import numpy as np
+import datetime as dt
+from bs4 import BeautifulSoup
+
+# Address of the weekly schedule (followed by the date of a Wednesday as
+# YYYYMMDD)
+SCHEDULE_URL = 'http://www.chicagofoodtruckfinder.com/weekly-schedule?date='
+
+# Day ordering matches page display
+days = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
+
+# Columns of the parsed records (the title of a truck's image holds its
+# parking times and name)
+record_columns = ['Location', 'Day', 'Title', 'Week']
+
+# Layout version of the manifests written by scrape_incremental
+MANIFEST_VERSION = 1
+
+
+# List the weeks to scrape
+def schedule_weeks(weeks=210, today=None):
+    """
+    Returns the dates (as YYYYMMDD) of the Wednesdays of the last weeks weekly schedules, most
+    recent first (the data is available back to August, 2011)
+    """
+
+    if today is None:
+        today = dt.datetime.today()
+    wednesday = today + dt.timedelta(days=-today.weekday() + 2, weeks=1)
+
+    return [dt.datetime.strftime(wednesday - dt.timedelta(weeks=x + 1), '%Y%m%d')
+            for x in xrange(weeks)]
+
+
+# List the days of a weekly schedule
+def week_dates(date):
+    """
+    Returns the dates (as YYYY-MM-DD) from the Sunday to the Saturday of the schedule of the
+    Wednesday date (as YYYYMMDD)
+    """
+
+    wednesday = dt.datetime.strptime(date, '%Y%m%d')
+    return [dt.datetime.strftime(wednesday + dt.timedelta(days=x), '%Y-%m-%d')
+            for x in xrange(-3, 4)]
+
+
+# Whether a saved page was fetched after its week was over
+def page_final(path, date):
+    """
+    Returns whether the page saved at path was saved after the Saturday of the schedule of date
+    """
+
+    end = dt.datetime.strptime(date, '%Y%m%d') + dt.timedelta(days=4)
+    return os.path.exists(path) and dt.datetime.fromtimestamp(os.path.getmtime(path)) >= end
+
+
+# Get a page
+def fetch_page(url, path=None, timeout=60):
+    """
+    Returns the html at url, reading it from path if that exists and else saving it there
+    """
+
+    if path is not None and os.path.exists(path):
+        with open(path) as f:
+            return f.read()
+
+    raw_html = urllib2.urlopen(url, timeout=timeout).read()
+    if path is not None:
+        with open(path + '.tmp', 'w') as f:
+            f.write(raw_html)
+        os.rename(path + '.tmp', path)
+
+    return raw_html
+
+
+# Get pages on a pool of threads
+def fetch_pages(urls, paths, workers=8, timeout=60):
+    """
+    Yields the position and html of each of the pages at urls (see fetch_page for paths) as they
+    arrive, with at most workers requests in flight
+    """
+
+    tasks = Queue.Queue()
+    for task in enumerate(zip(urls, paths)):
+        tasks.put(task)
+    results = Queue.Queue()
+
+    def work():
+        while True:
+            try:
+                (position, (url, path)) = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results.put((position, fetch_page(url, path, timeout), None))
+            except Exception as error:
+                results.put((position, None, error))
+
+    for x in xrange(min(workers, len(urls))):
+        thread = threading.Thread(target=work)
+        thread.daemon = True
+        thread.start()
+
+    for x in xrange(len(urls)):
+        (position, html, error) = results.get()
+
+        # Stop handing out pages before raising
+        if error is not None:
+            with tasks.mutex:
+                tasks.queue.clear()
+            raise error
+        yield (position, html)
+
+
+# Parse a weekly schedule page
+def parse_page(html):
+    """
+    Returns the records of a page as lists of the Location, Day, Title and Week of each truck
+    parking, walking the table cells once (a location cell starts a row of day cells)
+    """
+
+    soup = BeautifulSoup(html)
+    columns = dict((column, []) for column in record_columns)
+    week = soup.h1.text
+    location = ''
+    day = ''
+    count = 0
+
+    for cell in soup.find_all('td'):
+        if cell.get('style') == 'width:13%':
+            location = cell.text
+            count = 0
+
+        else:
+            day = days[count]
+            count += 1
+
+        titles = [image.get('title') for image in cell.find_all('img')]
+        columns['Location'].extend([location] * len(titles))
+        columns['Day'].extend([day] * len(titles))
+        columns['Title'].extend(titles)
+        columns['Week'].extend([week] * len(titles))
+
+    return columns
+
+
+# Clean the parsed records
+def clean_records(columns):
+    """
+    Takes lists of the Location, Day, Title and Week of each record and returns a DataFrame of
+    Location, Truck, Start_Time, End_Time, and Date (the schema of locations.csv)
+    """
+
+    records = pd.DataFrame(columns, columns=record_columns)
+
+    # Get truck name and parking time
+    location_data = pd.DataFrame({'Location': records.Location,
+                                  'Truck': records.Title.str[20:],
+                                  'Start_Time': records.Title.str[:8],
+                                  'End_Time': records.Title.str[11:19]},
+                                 columns=['Location', 'Truck', 'Start_Time', 'End_Time'])
+
+    # Construct date from the week's Wednesday and the day (parsing each
+    # distinct week once, note the indexing of datetime has Monday being 0)
+    (week_codes, weeks) = pd.factorize(records.Week)
+    coarse_dates = pd.DatetimeIndex([dt.datetime.strptime(week[11:], ' %b %d, %Y')
+                                     for week in weeks])
+    offsets = pd.Index(days).get_indexer(records.Day) - 1 - \
+        np.asarray(coarse_dates.weekday)[week_codes]
+    location_data['Date'] = coarse_dates[week_codes] + pd.to_timedelta(offsets, unit='D')
+
+    # Edit location names
+    location_data.Location = location_data.Location.str.replace(
+        '\n', '').str.replace(', Chicago, IL', '')
+
+    return location_data
+
+
+# Scrape the weekly schedules
+def scrape_schedules(dates, pages='.', workers=8, url=SCHEDULE_URL, timeout=60):
+    """
+    Returns the cleaned parking records of the weekly schedules of the given dates (in their order),
+    fetching the pages missing from the directory pages (as YYYYMMDD.txt) on workers threads and
+    parsing each page as it arrives. The parsed records of all pages are kept in memory and
+    cleaned once at the end (a few hundred weeks of schedules are small)
+    """
+
+    if not os.path.isdir(pages):
+        os.makedirs(pages)
+
+    parsed = [None] * len(dates)
+    for (position, html) in fetch_pages([url + date for date in dates],
+                                        [os.path.join(pages, date + '.txt') for date in dates],
+                                        workers, timeout):
+        parsed[position] = parse_page(html)
+
+    columns = dict((column, []) for column in record_columns)
+    for page in parsed:
+        for column in record_columns:
+            columns[column].extend(page[column])
+
+    return clean_records(columns)
+
+
+# Hash a page
+def page_hash(html):
+    """
+    Returns the sha1 hex digest of the html of a page
+    """
+
+    return hashlib.sha1(html).hexdigest()
+
+
+# Drop the records of some weeks from a locations.csv
+def drop_weeks(path, dates):
+    """
+    Rewrites the parking records at path without those of the weekly schedules of dates (streaming
+    the rows, which are otherwise kept as written)
+    """
+
+    dropped = set(date for week in dates for date in week_dates(week))
+    with open(path, 'rb') as f, open(path + '.tmp', 'wb') as g:
+        reader = csv.reader(f)
+        writer = csv.writer(g, lineterminator='\n')
+        header = next(reader)
+        writer.writerow(header)
+        column = header.index('Date')
+        writer.writerows(row for row in reader if row[column] not in dropped)
+    os.rename(path + '.tmp', path)
+
+
+# Write the manifest of scrape_incremental
+def write_manifest(path, manifest):
+    """
+    Replaces the manifest at path (writing a temporary file first)
+    """
+
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+
+# Scrape only the weeks missing from a parking dataset
+def scrape_incremental(dates, output, pages='.', workers=8, url=SCHEDULE_URL, timeout=60, today=None):
+    """
+    Adds the records of the weekly schedules of dates that are over (as of today) to the parking
+    records at output. A manifest in pages keeps the hash of each week's page. Weeks whose saved page
+    (saved after the week was over) matches it are skipped, other pages are fetched and only those
+    that are new or changed are parsed. New weeks are appended to output and changed ones replace
+    their records there (records appended by a run that stopped before updating the manifest are
+    removed first). Without a manifest output is written anew. Returns the records added and
+    the weeks parsed
+    """
+
+    if today is None:
+        today = dt.datetime.today()
+    if not os.path.isdir(pages):
+        os.makedirs(pages)
+
+    manifest_path = os.path.join(pages, 'manifest.json')
+    if os.path.exists(manifest_path) and os.path.exists(output):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest['version'] != MANIFEST_VERSION:
+            raise ValueError('manifest ' + manifest_path + ' has version ' +
+                             str(manifest['version']) + ', expected ' + str(MANIFEST_VERSION))
+    else:
+        manifest = {'version': MANIFEST_VERSION, 'next_index': 0, 'weeks': {}}
+    weeks = manifest['weeks']
+
+    # Cut off the records appended by a run that stopped before recording
+    # them (see below)
+    if manifest.get('pending') is not None:
+        with open(output, 'r+b') as f:
+            f.truncate(manifest['pending'])
+        manifest['pending'] = None
+
+    # Find the weeks to fetch (a page saved before its week was over may be
+    # missing parkings, so it is fetched again)
+    pending = []
+    for date in dates:
+        path = os.path.join(pages, date + '.txt')
+        if dt.datetime.strptime(date, '%Y%m%d') + dt.timedelta(days=4) > today:
+            continue
+        if page_final(path, date):
+            with open(path) as f:
+                if date in weeks and weeks[date]['sha1'] == page_hash(f.read()):
+                    continue
+        elif os.path.exists(path):
+            os.remove(path)
+        pending.append(date)
+
+    # Parse the new and changed pages as they arrive
+    parsed = dict()
+    hashes = dict()
+    for (position, html) in fetch_pages([url + date for date in pending],
+                                        [os.path.join(pages, date + '.txt') for date in pending],
+                                        workers, timeout):
+        date = pending[position]
+        hashes[date] = page_hash(html)
+        if date not in weeks or weeks[date]['sha1'] != hashes[date]:
+            parsed[date] = parse_page(html)
+
+    # Merge the records (in the order of dates)
+    parsed_dates = [date for date in dates if date in parsed]
+    columns = dict((column, []) for column in record_columns)
+    for date in parsed_dates:
+        for column in record_columns:
+            columns[column].extend(parsed[date][column])
+    changed = [date for date in parsed_dates if date in weeks]
+    if changed:
+        drop_weeks(output, changed)
+    records = len(columns['Title'])
+    if records > 0:
+        location_data = clean_records(columns)
+        location_data.index += manifest['next_index']
+        if manifest['next_index'] == 0:
+            location_data.to_csv(output, encoding='utf-8')
+
+        # Record the size of output before appending so that the next run
+        # can remove the records of a run that stops before the manifest is
+        # written
+        else:
+            manifest['pending'] = os.path.getsize(output)
+            write_manifest(manifest_path, manifest)
+            location_data.to_csv(output, mode='a', header=False, encoding='utf-8')
+            manifest['pending'] = None
+
+    # The manifest is written last so that a week is only recorded once its
+    # records are in output
+    for date in parsed_dates:
+        weeks[date] = {'sha1': hashes[date], 'records': len(parsed[date]['Title'])}
+    manifest['next_index'] += records
+    write_manifest(manifest_path, manifest)
+
+    return [records, len(parsed_dates)]
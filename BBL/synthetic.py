@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""
+synthetic.py: Generates panels of food truck parkings in the schema of
+the scraped location data for testing how the BBL pipeline scales
+"""
+
+__author__ = 'Eliot Abrams'
+__copyright__ = "Copyright (C) 2015 Eliot Abrams"
+__license__ = "MIT"
+__version__ = "1.0.0"
+__email__ = "eabrams@uchicago.edu"
+__status__ = "Production"
+
+
+# Packages
+import pandas as pd
+import numpy as np
+import os
+
+# Scraped names of the locations the kernel models (in the order of
+# location_names). Further locations are named Location 9, Location 10, ...
+chicago_locations = ['450 N. Cityfront Plaza', 'Clark and Monroe', 'Lasalle and Adams',
+                     'Madison and Wacker', 'Randolph and Columbus', 'University of Chicago',
+                     'Wacker and Adams', '600 West Chicago Avenue']
+
+# Truck types of the Chicago data (less Dessert, which createdata.py drops)
+chicago_types = ['American', 'Asian', 'French', 'Italian', 'Meat', 'Mexican', 'Other']
+
+# Typical (start, end) times of lunch and other parkings
+lunch_times = [('11:00 AM', '01:30 PM'), ('11:30 AM', '01:30 PM'), ('11:00 AM', '02:00 PM'),
+               ('10:30 AM', '01:00 PM')]
+other_times = [('07:00 AM', '10:00 AM'), ('04:30 PM', '08:00 PM'), ('05:00 PM', '09:00 PM')]
+
+
+# Generate a panel of parkings
+def generate_panel(trucks=45, locations=8, years=2, types=None, parking_frequency=0.6, concentration=1.0, lunch_share=0.9, start_year=2014, seed=None):
+    """
+    Returns a DataFrame of parkings with Location, Truck, Start_Time, End_Time, and Date (the schema
+    of locations.csv) and a DataFrame of Truck and Type (the schema of truck_types.csv). Each truck
+    parks on a share of the days around parking_frequency, at locations drawn from its own
+    preferences (Dirichlet with the given concentration, so smaller values make trucks more loyal
+    to a few locations), and lunch_share of the parkings span lunch. types is a number of types or
+    a list of their names and parking_frequency must lie strictly between 0 and 1
+    """
+
+    random_state = np.random.RandomState(seed)
+
+    # Name the locations, trucks and types
+    location_names = (chicago_locations + ['Location ' + str(x + 1) for x in
+                                           xrange(len(chicago_locations), locations)])[:locations]
+    truck_names = ['Truck ' + str(x + 1) for x in xrange(trucks)]
+    if types is None:
+        types = chicago_types
+    elif isinstance(types, int):
+        types = ['Type ' + str(x + 1) for x in xrange(types)]
+    truck_types = pd.DataFrame({'Truck': truck_names,
+                                'Type': [types[x] for x in random_state.randint(0, len(types), trucks)]},
+                               columns=['Truck', 'Type'])
+
+    # Draw each truck's parking frequency and location preferences
+    dates = pd.date_range(start=str(start_year) + '-01-01', end=str(start_year + years - 1) + '-12-31',
+                          freq='D')
+    frequencies = random_state.beta(10 * parking_frequency, 10 * (1 - parking_frequency), trucks)
+    preferences = random_state.dirichlet(np.ones(locations) * concentration, trucks)
+
+    # Draw the parkings and their locations (searching the trucks' cumulative
+    # preferences laid end to end, each shifted by its truck's row)
+    (truck_rows, date_rows) = np.nonzero(random_state.rand(trucks, len(dates)) < frequencies[:, np.newaxis])
+    cumulative = (preferences.cumsum(axis=1) + np.arange(trucks)[:, np.newaxis]).ravel()
+    location_rows = np.searchsorted(cumulative, random_state.rand(len(truck_rows)) + truck_rows,
+                                    side='right') - truck_rows * locations
+    location_rows = np.minimum(location_rows, locations - 1)
+
+    # Draw the times of the parkings
+    lunch = random_state.rand(len(truck_rows)) < lunch_share
+    times = np.where(lunch, random_state.randint(0, len(lunch_times), len(truck_rows)),
+                     len(lunch_times) + random_state.randint(0, len(other_times), len(truck_rows)))
+    start_times = np.array([time[0] for time in lunch_times + other_times], dtype=object)
+    end_times = np.array([time[1] for time in lunch_times + other_times], dtype=object)
+
+    location_data = pd.DataFrame({'Location': np.array(location_names, dtype=object)[location_rows],
+                                  'Truck': np.array(truck_names, dtype=object)[truck_rows],
+                                  'Start_Time': start_times[times],
+                                  'End_Time': end_times[times],
+                                  'Date': np.array([str(date.date()) for date in dates],
+                                                   dtype=object)[date_rows]},
+                                 columns=['Location', 'Truck', 'Start_Time', 'End_Time', 'Date'])
+    location_data = location_data.iloc[np.lexsort([truck_rows, date_rows])].reset_index(drop=True)
+
+    return [location_data, truck_types]
+
+
+# Write a generated panel
+def write_panel(path, location_data, truck_types):
+    """
+    Writes locations.csv and truck_types.csv to the directory path (so that createdata.py can run there)
+    """
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    location_data.to_csv(os.path.join(path, 'locations.csv'))
+    truck_types.to_csv(os.path.join(path, 'truck_types.csv'), index=False)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+"""
+benchmark.py: Times and records the memory use of each stage of the
+BBL pipeline on the bundled location data or a synthetic panel written by
+generatedata.py (and on copies of it scaled up by adding trucks) and writes
+the results as JSON so that versions can be compared
+"""
+
+__author__ = 'Eliot Abrams'
+__copyright__ = "Copyright (C) 2015 Eliot Abrams"
+__license__ = "MIT"
+__version__ = "1.0.0"
+__email__ = "eabrams@uchicago.edu"
+__status__ = "Production"
+
+
+# Import packages
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import os
+import time
+from BBL.estimation import *
+from BBL.pipeline import clean_parkings, build_panel
+
+
+##############################
+##         Helpers          ##
+##############################
+
+# Current and peak resident memory of the process in megabytes
+def memory():
+    """
+    Returns the current resident set size (from /proc where available) and the peak resident
+    set size of the process in megabytes
+    """
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1]) * resource.getpagesize() / 1024. ** 2
+    except IOError:
+        current = None
+    return [current, peak]
+
+
+# Time a stage of the pipeline
+def measure(stage, scale, repeat, function):
+    """
+    Runs function repeat times and returns a record with the best and mean time in seconds
+    and the memory before and after the runs (the output of the final run is returned too)
+    """
+
+    (before, peak_before) = memory()
+    times = []
+    for x in xrange(repeat):
+        start = time.time()
+        output = function()
+        times.append(time.time() - start)
+    (after, peak_after) = memory()
+
+    record = {'stage': stage,
+              'scale': scale,
+              'repeat': repeat,
+              'best_seconds': min(times),
+              'mean_seconds': sum(times) / len(times),
+              'rss_before_mb': before,
+              'rss_after_mb': after,
+              'peak_rss_mb': peak_after,
+              'peak_rss_increase_mb': peak_after - peak_before}
+    print '%-22s scale %-3d best %9.4fs  mean %9.4fs  rss %8.1f MB' % (
+        stage, scale, record['best_seconds'], record['mean_seconds'], after or peak_after)
+
+    return [record, output]
+
+
+# Build the lunch time panel of the bundled location data (the same cleaning
+# as createdata.py)
+def load_panel(path):
+    """
+    Returns the complete panel of Truck, Date, and Location and the truck types in the directory path
+    """
+
+    (location_data, truck_types) = clean_parkings(os.path.join(path, 'locations.csv'),
+                                                  pd.read_csv(os.path.join(path, 'truck_types.csv')))
+
+    # Lump the rare locations into Other and complete the panel
+    return build_panel(location_data, truck_types)
+
+
+# Scale the panel up by adding copies of every truck
+def scale_panel(location_data, truck_types, scale):
+    """
+    Returns the panel and truck types with scale copies of each truck
+    """
+
+    if scale == 1:
+        return [location_data, truck_types]
+
+    panels = []
+    types = []
+    for copy in xrange(scale):
+        panel = location_data.copy()
+        kinds = truck_types.copy()
+        if copy > 0:
+            panel['Truck'] = panel.Truck + ' ' + str(copy)
+            kinds['Truck'] = kinds.Truck + ' ' + str(copy)
+        panels.append(panel)
+        types.append(kinds)
+
+    return [pd.concat(panels, ignore_index=True), pd.concat(types, ignore_index=True)]
+
+
+##############################
+##        Benchmark         ##
+##############################
+
+parser = argparse.ArgumentParser(description='Benchmark the stages of the BBL pipeline')
+parser.add_argument('--scales', type=int, nargs='+', default=[1, 2],
+                    help='copies of each truck in the scaled inputs')
+parser.add_argument('--repeat', type=int, default=3, help='runs of each stage')
+parser.add_argument('--periods', type=int, default=20)
+parser.add_argument('--N', type=int, default=10)
+parser.add_argument('--num-draws', type=int, default=20)
+parser.add_argument('--processes', type=int, default=None)
+parser.add_argument('--data', default='.',
+                    help='directory with locations.csv and truck_types.csv (see generatedata.py)')
+parser.add_argument('--output', default='benchmark.json')
+arguments = parser.parse_args()
+
+# Record the versions so that results can be compared across them
+try:
+    commit = subprocess.check_output(['git', 'rev-parse', 'HEAD']).strip()
+except (OSError, subprocess.CalledProcessError):
+    commit = None
+results = {'commit': commit,
+           'time': dt.datetime.now().isoformat(),
+           'python': platform.python_version(),
+           'numpy': np.__version__,
+           'pandas': pd.__version__,
+           'settings': vars(arguments),
+           'stages': []}
+
+np.random.seed(1234)
+(record, (panel, panel_types)) = measure('ingest_locations', 1, arguments.repeat,
+                                         lambda: load_panel(arguments.data))
+results['stages'].append(record)
+
+for scale in arguments.scales:
+    (location_data, truck_types) = scale_panel(panel, panel_types, scale)
+    stages = results['stages']
+
+    # Create the data
+    (record, (locations_w_states, state_variables)) = measure(
+        'make_states', scale, arguments.repeat,
+        lambda: make_states(location_data=location_data.copy(), making_probabilities=True,
+                            truck_types=truck_types))
+    record['trucks'] = len(truck_types)
+    record['state_width'] = len(state_variables)
+    stages.append(record)
+    (record, probabilities) = measure(
+        'find_probabilities', scale, arguments.repeat,
+        lambda: find_probabilities(locations_w_states=locations_w_states.copy(),
+                                   state_variables=state_variables))
+    states = pd.DataFrame(locations_w_states.State.drop_duplicates())
+    record['states'] = len(states)
+    record['ccp_rows'] = len(probabilities)
+    stages.append(record)
+
+    # Single steps of the simulation
+    policy = compile_policy(probabilities)
+    state = encode_state(states.State.iloc[0])
+    (record, actions) = measure(
+        'optimal_action', scale, arguments.repeat,
+        lambda: optimal_action(policy, state, truck_types, state_variables))
+    stages.append(record)
+    plan = make_simulation_plan(state_variables, truck_types)
+    week = new_week(1, plan)
+    (record, output) = measure(
+        'update_state', scale, arguments.repeat,
+        lambda: update_state(state, week, dt.datetime(2014, 1, 6), state_variables,
+                             truck_types, plan))
+    stages.append(record)
+
+    # Simulations
+    truck = truck_types.Truck.iloc[0]
+    (record, output) = measure(
+        'simulate_single_path', scale, arguments.repeat,
+        lambda: simulate_single_path(policy, states.State.iloc[0], '2014-01-06',
+                                     arguments.periods, .99, state_variables, truck,
+                                     'Random', '', truck_types, numeric=True))
+    stages.append(record)
+    policy_table = compile_policy_table(probabilities, truck_types)
+    (record, output) = measure(
+        'find_value_function', scale, arguments.repeat,
+        lambda: find_value_function(policy_table, states.State.iloc[0], '2014-01-06',
+                                    arguments.periods, .99, state_variables, truck, 'Random',
+                                    '', arguments.N, truck_types, numeric=True, seed=1))
+    stages.append(record)
+    (record, g) = measure(
+        'build_g', scale, arguments.repeat,
+        lambda: build_g(states=states.copy(), probabilities=policy_table,
+                        periods=arguments.periods, discount=.99,
+                        state_variables=state_variables, N=arguments.N,
+                        truck_types=truck_types, num_draws=arguments.num_draws,
+                        numeric=True, processes=arguments.processes, fan_out=True))
+    stages.append(record)
+
+    # Estimation
+    (record, output) = measure('optimize', scale, arguments.repeat, lambda: optimize(g))
+    stages.append(record)
+
+with open(arguments.output, 'w') as f:
+    json.dump(results, f, indent=2, sort_keys=True)
+print 'Wrote ' + arguments.output
@@ -21,10 +21,11 @@ import os
 os.chdir('/Users/eliotabrams/Desktop/BBL')
 """
 
-# Import packages and force re-creation of module
-import BBL
-reload(BBL)
-from BBL import *
+# Import packages
+import BBL.kernel
+from BBL.kernel import *
+from BBL.pipeline import build_data, drop_rare_locations
+from BBL.counts import make_count_store, save_count_store
 
 # Set seed
 np.random.seed(1234)
@@ -34,66 +35,34 @@ np.random.seed(1234)
 ## Clean and report on data ##
 ##############################
 
-# Import location data (only observe when a truck parks at a
-# popular location)
-location_data = pd.read_csv('locations.csv', index_col=0)
+# Build the data in stages cached in the cache directory (only the stages
+# below a changed input file or parameter are rerun)
+# Drops dessert and breakfast only trucks, and cleans the location data in
+# chunks (only observe when a truck parks at a popular location), dropping
+# old data, weekends, rare trucks, non-city and non-lunch parkings and truck,
+# date duplicates
+# Parkings at rare locations then get lumped into an other category. I
+# particularly want to exclude Daley Plaza as it only opens for lunch
+# service on one day a week (and the day cycles)
+data = build_data('locations.csv', 'truck_types.csv', cache='cache', truck_cutoff=66,
+                  location_cutoff=150, quantile=0.8)
+location_data = data['parkings']
+location_data.to_csv('clean_locations.csv')
 
 """
 # Raw summary statistics
-print len(location_data)
-print len(location_data.groupby('Truck').Truck.count())
-print len(location_data.groupby('Location').Truck.count())
+raw_data = pd.read_csv('locations.csv', index_col=0)
+print len(raw_data)
+print len(raw_data.groupby('Truck').Truck.count())
+print len(raw_data.groupby('Location').Truck.count())
 """
 
-# Drop old data
-location_data['Year'] = pd.to_datetime(location_data['Date']).dt.year
-#location_data.groupby(['Truck', 'Year']).Location.count().unstack().to_csv('identify_old.csv')
-location_data = location_data[location_data.Year > 2013]
-location_data = location_data.drop('Year', axis=1)
-
-# Drop weekends
-location_data = location_data[
-    pd.to_datetime(location_data['Date']).dt.weekday < 5]
-
-# Drop rare trucks
-truck_counts = location_data.groupby(['Truck']).Truck.count()
-truck_counts = truck_counts[truck_counts > 66]
-truck_counts = pd.DataFrame([truck_counts]).transpose()
-truck_counts.columns = ['Count']
-truck_counts.reset_index(level=0, inplace=True)
-truck_counts = truck_counts.drop('Count', axis=1)
-location_data = location_data.merge(truck_counts, on="Truck")
-
 """
 # Print list of food trucks so that I can add type by hand
 os.chdir('/Users/eliotabrams/Desktop/Data')
 location_data.groupby('Truck')['Truck'].count().to_csv('truck_types.csv')
 """
 
-# Drop dessert and breakfast only trucks
-truck_types = pd.read_csv('truck_types.csv')
-truck_types = truck_types[truck_types.Type != 'Dessert']
-location_data = location_data.merge(pd.DataFrame([truck_types.Truck]
-                                                 ).transpose(), on='Truck')
-location_data = location_data[location_data.Truck != 'Eastman Egg']
-
-# Drop non-city parkings
-location_data = location_data[location_data.Location != 'Schaumburg Area']
-location_data = location_data[location_data.Location !=
-                              '1815 South Meyers Road, Oakbrook Terrace, IL']
-
-# Drop non-lunch parkings (note that time is converted to 24 hour clock)
-location_data['Start_Time'] = location_data.Start_Time.apply(
-    lambda x: dt.datetime.strptime(x, '%I:%M %p'))
-location_data['End_Time'] = location_data.End_Time.apply(
-    lambda x: dt.datetime.strptime(x, '%I:%M %p'))
-location_data = location_data[(location_data.Start_Time.dt.hour < 12)
-                              & (location_data.End_Time.dt.hour > 12)]
-location_data = location_data.drop(['Start_Time', 'End_Time'], axis=1)
-
-# Because of data errors there are still truck, date duplicates
-location_data = location_data.drop_duplicates(['Truck', 'Date'])
-
 """
 # Summary statistics
 print len(location_data)
@@ -101,20 +70,9 @@ print len(location_data.groupby('Truck').Truck.count())
 print len(location_data.groupby('Location').Truck.count())
 """
 
-# Drop rare locations
-# Parkings here will then later get lumped into an other category
-# I particularly want to exclude Daley Plaza as it only opens
-# for lunch service on one day a week (and the day cycles)
-truck_counts = location_data.groupby(['Location']).Truck.count()
-truck_counts = truck_counts[truck_counts > 150]
-truck_counts = pd.DataFrame([truck_counts]).transpose()
-truck_counts.columns = ['Count']
-truck_counts.reset_index(level=0, inplace=True)
-truck_counts = truck_counts.drop('Count', axis=1)
-location_data = location_data.merge(truck_counts, on='Location')
-
 """
-# Summary statistics
+# Summary statistics (without the rare locations)
+location_data = drop_rare_locations(location_data, 150)
 print len(location_data)
 print len(location_data.groupby('Truck').Truck.count())
 print len(location_data.groupby('Location').Truck.count())
@@ -155,22 +113,10 @@ table = table.unstack()
 table = table[table == 'University of Chicago']
 """
 
-# Clean the location names
-location_data.Location = location_data.Location.str.replace(' ', '')
-location_data.Location = location_data.Location.str.replace('600', '')
-location_data.Location = location_data.Location.str.replace('450N.', '')
-
-# Complete panel if making probabilities (else complete by construction)
-location_data = location_data.pivot(
-    index='Date', columns='Truck', values='Location')
-location_data = location_data.unstack().reset_index(
-    name='Location')
-location_data.Location = location_data.Location.fillna('Other')
-
-# Reset truck types so DataFrame only contains trucks present in the
-# final data
-truck_types = pd.merge(truck_types, pd.DataFrame(
-    location_data.drop_duplicates('Truck').Truck), on='Truck')
+# The complete panel (locations the model does not cover are lumped into
+# Other like the rare ones) and the types of the trucks present in it
+location_data = data['location_data']
+truck_types = data['truck_types']
 truck_types.to_csv('final_truck_types.csv')
 
 
@@ -179,22 +125,30 @@ truck_types.to_csv('final_truck_types.csv')
 ##############################
 
 # Create states
-(locations_w_states, state_variables) = make_states(
-    location_data=location_data, making_probabilities=True, truck_types=truck_types)
+locations_w_states = data['locations_w_states']
+state_variables = data['state_variables']
 states = locations_w_states.State.drop_duplicates()
 pd.DataFrame(states).to_csv('states.csv')
 pd.DataFrame(state_variables).to_csv('state_variables.csv')
 
 # Create probabilities
-probabilities = find_probabilities(
-    locations_w_states=locations_w_states, state_variables=state_variables)
+probabilities = data['probabilities']
 probabilities.to_csv('probabilities.csv')
 
+# Bundle the simulation inputs for simulate.py
+save_bundle('bundle', states=states, probabilities=probabilities,
+            state_variables=state_variables, truck_types=truck_types)
+
+# Store the counts behind the probabilities so that updatedata.py can add
+# new weeks of data to the bundle
+save_count_store('counts', make_count_store(location_data, locations_w_states,
+                                            state_variables, truck_types))
+
 """
 # Examine results (note that an other location has been added for a total of 9 locations)
-  print BBL.HIGH_COUNT
-  print BBL.HIGH_UNIQUE
-  print BBL.HIGH_FREQ
+  print BBL.kernel.HIGH_COUNT
+  print BBL.kernel.HIGH_UNIQUE
+  print BBL.kernel.HIGH_FREQ
   print len(state_variables)
   print len(locations_w_states)
   print len(locations_w_states.groupby('Truck').Truck.count())
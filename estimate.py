@@ -19,10 +19,10 @@ import os
 os.chdir('/Users/eliotabrams/Desktop/BBL')
 """
 
-# Import packages and force re-creation of module
-import BBL
-reload(BBL)
-from BBL import *
+# Import packages
+import glob
+import os
+from BBL.estimation import *
 
 # Set seed
 np.random.seed(1234)
@@ -33,42 +33,23 @@ np.random.seed(1234)
 ##         Estimate         ##
 ##############################
 
-print(open('s1.csv').read())
-
-# Import the data
-g = pd.DataFrame()
-for x in xrange(8):
-    lines = pd.read_csv('s' + str(x+1)+'.csv', skip_blank_lines=True, header=None)
-    g = g.append(lines)
-g.columns = ['g']
-g = g.reset_index().drop('index', axis=1)
-g.g = g.g.apply(lambda row: sp.sympify(row))
+# Import the g terms written by each stage of simulate.py and those of the
+# inequalities finished so far by stages that have not completed
+g = [load_g(path) for path in sorted(glob.glob('s*.npy'))]
+g += [checkpoint_g(path) for path in sorted(glob.glob('s*.npy.ckpt'))
+      if not os.path.exists(path[:-len('.ckpt')])]
+g = np.concatenate(g)
 
-# Store
-g.to_csv('g.csv')
-
-# Get the point estimate
-(res, variables) = optimize(g)
+# Get the point estimate and bootstrap the SEs
+(res, bootstrap_results) = bootstrap(g, replications=500, size=40, processes=mp.cpu_count())
 coefs = list(res.x)
 coefs.append(res.success)
+variables = list(bootstrap_results.columns)
 results = pd.DataFrame(coefs).transpose()
-variables.append('Converged')
 results.columns = variables
 print results.transpose()
 
-# Bootstrap the SEs
-bootstrap_results = pd.DataFrame()
-for x in xrange(10):
-    g_bootstrap_sample = g.iloc[np.random.randint(0, len(g), size=40)]
-    (res, variables) = optimize(g_bootstrap_sample)
-    coefs = list(res.x)
-    coefs.append(res.success)
-    bootstrap_results = bootstrap_results.append(pd.DataFrame(coefs).transpose())
-variables.append('Converged')
-bootstrap_results.columns = variables
-
 # Examine results
-bootstrap_results = bootstrap_results.reset_index().drop(['index'], axis=1)
 bootstrap_results = bootstrap_results.applymap(float)
 print bootstrap_results.describe().transpose()
 print bootstrap_results.describe().transpose().sort()[['mean', 'std']].to_latex()
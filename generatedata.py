@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+"""
+generatedata.py: Writes a synthetic panel of food truck parkings (a
+locations.csv and a matching truck_types.csv) for running and benchmarking
+the BBL pipeline on data larger than the Chicago data
+"""
+
+__author__ = 'Eliot Abrams'
+__copyright__ = "Copyright (C) 2015 Eliot Abrams"
+__license__ = "MIT"
+__version__ = "1.0.0"
+__email__ = "eabrams@uchicago.edu"
+__status__ = "Production"
+
+
+# Import packages
+import argparse
+from BBL.synthetic import *
+
+
+##############################
+##         Generate         ##
+##############################
+
+parser = argparse.ArgumentParser(description='Write a synthetic panel of food truck parkings')
+parser.add_argument('--trucks', type=int, default=45)
+parser.add_argument('--locations', type=int, default=8,
+                    help='locations beyond the 8 Chicago ones are lumped into Other by the kernel')
+parser.add_argument('--years', type=int, default=2)
+parser.add_argument('--types', type=int, default=None,
+                    help='number of truck types (the Chicago types by default)')
+parser.add_argument('--parking-frequency', type=float, default=0.6)
+parser.add_argument('--concentration', type=float, default=1.0)
+parser.add_argument('--lunch-share', type=float, default=0.9)
+parser.add_argument('--start-year', type=int, default=2014)
+parser.add_argument('--seed', type=int, default=1234)
+parser.add_argument('--output', default='synthetic')
+arguments = parser.parse_args()
+
+(location_data, truck_types) = generate_panel(trucks=arguments.trucks,
+                                              locations=arguments.locations,
+                                              years=arguments.years,
+                                              types=arguments.types,
+                                              parking_frequency=arguments.parking_frequency,
+                                              concentration=arguments.concentration,
+                                              lunch_share=arguments.lunch_share,
+                                              start_year=arguments.start_year,
+                                              seed=arguments.seed)
+write_panel(arguments.output, location_data, truck_types)
+print 'Wrote ' + str(len(location_data)) + ' parkings of ' + str(len(truck_types)) + \
+    ' trucks to ' + arguments.output
@@ -3,7 +3,9 @@
 """
 simulate.py: Imports the BBL module and uses the commands therein 
 to run a BBL simulation on location data of Chicago Food Trucks
-Returns an element of g(E_{ia})
+Writes the g(E_{ia}) terms to the .npy file given as its first argument
+(and the run's metrics to the JSON file given as its second), checkpointing
+the inequalities finished so far to the file of that name plus .ckpt
 """
 
 __author__ = 'Eliot Abrams'
@@ -20,25 +22,22 @@ import os
 os.chdir('/Users/eliotabrams/Desktop/BBL')
 """
 
-# Import packages and force re-creation of module
-import BBL
-import ast
+# Import packages
+import sys
+import os
 import multiprocessing as mp
-
-reload(BBL)
-from BBL import *
+from BBL.kernel import *
 
 ##############################
 ##         Simulate         ##
 ##############################
 
-# Read in data
-states = pd.read_csv('states.csv', index_col=0, converters={'State': ast.literal_eval})
-probabilities = pd.read_csv('probabilities.csv', index_col=0)
-truck_types = pd.read_csv('final_truck_types.csv', index_col=0)
-state_variables = pd.read_csv('state_variables.csv', index_col=0)
-state_variables = state_variables['0'].tolist()
-
+# Read in the data bundled by createdata.py
+bundle = load_bundle('bundle')
+states = bundle['states']
+probabilities = bundle['probabilities']
+truck_types = bundle['truck_types']
+state_variables = bundle['state_variables']
 
 # Estimate the coefficients and their standard errors
 # Periods controls the number of days the simulation runs for.
@@ -51,6 +50,16 @@ state_variables = state_variables['0'].tolist()
 # Try setting xrange = 1, periods = 10, N=1, and num_draws=20 to begin.
 
 # Stage 1
+# Record metrics of the run if a second argument names a file for them
+if len(sys.argv) > 2:
+    enable_instrumentation()
+
+# Finished inequalities are checkpointed next to the output so that stages
+# run side by side do not share a checkpoint and a rerun of a stage resumes
+# where it stopped
+output = sys.argv[1] if len(sys.argv) > 1 else 's1.npy'
+checkpoint = output + '.ckpt'
+
 g = build_g(states=states, 
             probabilities=probabilities, 
             periods=40, 
@@ -58,13 +67,16 @@ g = build_g(states=states,
             state_variables=state_variables,
             N=5,
             truck_types=truck_types, 
-            num_draws=5)
-
-g = g.reset_index()
-print g.g[0]
-print g.g[1] 
-print g.g[2] 
-print g.g[3] 
-print g.g[4] 
-
+            num_draws=5,
+            numeric=True,
+            processes=mp.cpu_count(),
+            checkpoint=checkpoint,
+            fan_out=True)
 
+# Store the g terms (estimate.py reads the s*.npy files of all stages) and
+# drop the checkpoint so that the next run draws new inequalities
+save_g(output, g)
+os.remove(checkpoint)
+print 'Wrote ' + str(len(g)) + ' g terms to ' + output
+if len(sys.argv) > 2:
+    write_metrics(sys.argv[2], disable_instrumentation())
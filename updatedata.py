@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+"""
+updatedata.py: Adds new weeks of scraped parking locations to the count
+store and bundle written by createdata.py. Only the new weeks are cleaned
+and given states and only the probabilities of the sub-states they reach
+are recomputed
+"""
+
+__author__ = 'Eliot Abrams'
+__copyright__ = "Copyright (C) 2015 Eliot Abrams"
+__license__ = "MIT"
+__version__ = "1.0.0"
+__email__ = "eabrams@uchicago.edu"
+__status__ = "Production"
+
+
+# Import packages
+import argparse
+from BBL.kernel import *
+from BBL.pipeline import clean_parkings, build_panel
+from BBL.counts import *
+
+
+##############################
+##          Update          ##
+##############################
+
+parser = argparse.ArgumentParser(description='Add new weeks of parking data to the bundle')
+parser.add_argument('locations',
+                    help='scraped locations (in the schema of locations.csv) of the new weeks')
+parser.add_argument('--counts', default='counts')
+parser.add_argument('--bundle', default='bundle')
+arguments = parser.parse_args()
+
+store = load_count_store(arguments.counts)
+bundle = load_bundle(arguments.bundle, mmap=False)
+truck_types = store['truck_types']
+if list(bundle['truck_types'].Truck) != list(truck_types.Truck):
+    raise ValueError('bundle ' + arguments.bundle + ' and count store ' + arguments.counts +
+                     ' have different trucks')
+
+# Clean the new parkings as in createdata.py. The trucks and locations are
+# those of the store, so the rare truck and location cutoffs do not apply to
+# the new weeks on their own
+(location_data, types) = clean_parkings(arguments.locations, truck_types, truck_cutoff=0)
+location_data = location_data[location_data.Date > store['last_date']]
+(location_data, types) = build_panel(location_data, types, location_cutoff=0,
+                                     trucks=truck_types.Truck)
+
+# Add the counts and refresh the probabilities of the sub-states reached
+(locations_w_states, state_keys) = update_count_store(store, location_data)
+probabilities = refresh_policy_table(bundle['probabilities'], store, state_keys)
+
+# Add the new states to the bundle. The bundle is written before the counts:
+# a rerun after a crash between the two adds the new weeks to the old counts
+# once and refreshes the same rows of the bundle again
+states = pd.concat([pd.Series([tuple(state) for state in bundle['states'].State]),
+                    locations_w_states.State], ignore_index=True).drop_duplicates()
+save_bundle(arguments.bundle, states=states, probabilities=probabilities,
+            state_variables=bundle['state_variables'], truck_types=truck_types)
+save_count_store(arguments.counts, store)
+print 'Added ' + str(len(locations_w_states)) + ' truck days through ' + store['last_date'] + \
+    ' (' + str(len(state_keys)) + ' sub-states refreshed)'